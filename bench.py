@@ -0,0 +1,418 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Small benchmarks for the performance sensitive paths of 'impl.py'.
+#
+# Run command:
+#   `python bench.py`
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def bench_import_time(runs: int = 5) -> float:
+    # Importing impl must not load or upload any data, so this should stay
+    # close to the cost of importing its dependencies (pandas, numpy, requests)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import impl"], cwd=HERE, check=True)
+        timings.append(time.perf_counter() - start)
+
+    baseline = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import pandas"], cwd=HERE, check=True)
+        baseline.append(time.perf_counter() - start)
+
+    median = statistics.median(timings)
+    print(
+        f"import impl: median {median * 1000:.1f} ms, "
+        f"min {min(timings) * 1000:.1f} ms over {runs} runs "
+        f"(import pandas alone: {statistics.median(baseline) * 1000:.1f} ms)"
+    )
+    return median
+
+
+def make_process_json(path: str, items: int) -> None:
+    # Synthetic process file with the same shape as 'Data/process (2).json'
+    def activity(i: int, technique: bool = False) -> dict:
+        data = {
+            "responsible institute": f"Institute {i % 50}",
+            "responsible person": f"Person {i % 500}",
+            "tool": [f"Tool {i % 20}", f"Tool {i % 7}"],
+            "start date": f"2023-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            "end date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+        }
+        if technique:
+            data["technique"] = f"Technique {i % 10}"
+        return data
+
+    with open(path, "w") as f:
+        json.dump(
+            [
+                {
+                    "object id": str(i),
+                    "acquisition": activity(i, technique=True),
+                    "processing": activity(i + 1),
+                    "modelling": activity(i + 2),
+                    "optimising": activity(i + 3),
+                    "exporting": activity(i + 4),
+                }
+                for i in range(items)
+            ],
+            f,
+        )
+
+
+def bench_process_upload(items: int = 100000) -> float:
+    import impl
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "process.json")
+        make_process_json(json_path, items)
+
+        u = impl.ProcessDataUploadHandler()
+        u.setDbPathOrUrl(os.path.join(tmp, "relational.db"))
+        start = time.perf_counter()
+        u.pushDataToDb(json_path)
+        elapsed = time.perf_counter() - start
+
+    activities = items * len(impl.ACTIVITY_TYPES)
+    print(
+        f"ProcessDataUploadHandler: {activities} activities in {elapsed:.2f} s "
+        f"({activities / elapsed:.0f} activities/s)"
+    )
+    return elapsed
+
+
+def bench_metadata_conversion(rows: int = 1000000) -> float:
+    # CSV to N-Triples conversion only, nothing is sent to Blazegraph
+    import pandas as pd
+    import impl
+
+    sample = pd.read_csv(os.path.join(HERE, "Data", "meta.csv"), keep_default_na=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "meta.csv")
+        big = sample.sample(n=rows, replace=True, random_state=0)
+        big["Id"] = range(1, rows + 1)
+        big.to_csv(csv_path, index=False)
+
+        u = impl.MetadataUploadHandler()
+        triples = 0
+        start = time.perf_counter()
+        with pd.read_csv(
+            csv_path, keep_default_na=False, dtype="string", chunksize=u.chunk_size
+        ) as reader:
+            for chunk in reader:
+                triples += len(u._chunkToTriples(chunk))
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"MetadataUploadHandler: {rows} CSV rows -> {triples} triples in "
+        f"{elapsed:.2f} s ({rows / elapsed:.0f} rows/s)"
+    )
+    return elapsed
+
+
+def bench_process_queries(items: int = 20000, calls: int = 1000) -> float:
+    # Latency of ProcessDataQueryHandler methods on a loaded database
+    import impl
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "process.json")
+        make_process_json(json_path, items)
+        u = impl.ProcessDataUploadHandler()
+        u.setDbPathOrUrl(os.path.join(tmp, "relational.db"))
+        u.pushDataToDb(json_path)
+
+        q = impl.ProcessDataQueryHandler()
+        q.setDbPathOrUrl(u.getDbPathOrUrl())
+        start = time.perf_counter()
+        for i in range(calls):
+            q.getActivitiesByResponsiblePerson(f"Person {i % 500}", "exact")
+            q.getActivitiesStartedAfter("2023-12-28")
+        elapsed = time.perf_counter() - start
+        q.close()
+
+    print(
+        f"ProcessDataQueryHandler: {2 * calls} queries in {elapsed:.2f} s "
+        f"({elapsed / (2 * calls) * 1000:.2f} ms/query)"
+    )
+    return elapsed
+
+
+class _FrameHandler(object):
+    # Hands out prebuilt DataFrames in place of a query handler, so the
+    # mashup benchmarks time the materialisation alone
+    def __init__(self, activities=None, objects=None):
+        self.activities = activities
+        self.objects = objects
+
+    def getAllActivities(self):
+        return self.activities
+
+    def getAllCulturalHeritageObjects(self):
+        return self.objects
+
+
+def make_activities_frame(rows: int):
+    import pandas as pd
+    import impl
+
+    i = pd.RangeIndex(rows)
+    types = pd.Series(impl.ACTIVITY_TYPES).iloc[i % 5].reset_index(drop=True)
+    return pd.DataFrame(
+        {
+            "object_id": (i // 5).astype(str),
+            "responsible_institute": "Institute " + (i % 50).astype(str),
+            "responsible_person": "Person " + (i % 500).astype(str),
+            "technique": pd.Series("Technique", index=i).where(types == "Acquisition"),
+            "tool": "Tool " + (i % 20).astype(str),
+            "start_date": "2023-01-01",
+            "end_date": "2024-01-01",
+            "type": types,
+        }
+    )
+
+
+def make_objects_frame(rows: int):
+    import pandas as pd
+    import impl
+
+    i = pd.RangeIndex(rows)
+    return pd.DataFrame(
+        {
+            "type_name": pd.Series(list(impl.OBJECT_CLASSES)).iloc[i % 10].values,
+            "id": i.astype(str),
+            "title": "Title " + i.astype(str),
+            "date": "1700",
+            "owner": "Owner " + (i % 30).astype(str),
+            "place": "Place " + (i % 40).astype(str),
+            "author_id": "VIAF:" + (i % 1000).astype(str),
+            "author_name": "Author " + (i % 1000).astype(str),
+        }
+    )
+
+
+def bench_mashup_materialization(rows: int = 1000000) -> float:
+    # DataFrame -> entity objects in BasicMashup, no database involved
+    import contextlib
+    import io
+    import impl
+
+    handler = _FrameHandler(make_activities_frame(rows), make_objects_frame(rows))
+    m = impl.BasicMashup([handler], [handler])
+
+    total = 0.0
+    for name in ("getAllActivities", "getAllCulturalHeritageObjects"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = getattr(m, name)()
+            elapsed = time.perf_counter() - start
+        total += elapsed
+        print(
+            f"BasicMashup.{name}: {len(result)} objects in {elapsed:.2f} s "
+            f"({len(result) / elapsed:.0f} objects/s)"
+        )
+    return total
+
+
+def bench_lazy_results(rows: int = 1000000, page: int = 100) -> float:
+    # Count plus one page from the middle of a lazy mashup result
+    import contextlib
+    import io
+    import impl
+
+    handler = _FrameHandler(make_activities_frame(rows), make_objects_frame(rows))
+    m = impl.BasicMashup([handler], [handler], lazy=True)
+
+    total = 0.0
+    for name in ("getAllActivities", "getAllCulturalHeritageObjects"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = getattr(m, name)()
+            middle = len(result) // 2
+            items = list(result[middle:middle + page])
+            elapsed = time.perf_counter() - start
+        total += elapsed
+        print(
+            f"BasicMashup.{name} (lazy): len {len(result)} and a page of "
+            f"{len(items)} in {elapsed * 1000:.0f} ms"
+        )
+    return total
+
+
+def _canned_sparql_endpoint(frame):
+    # Local HTTP endpoint answering every query with the rows of frame as
+    # CSV, SPARQL JSON or TSV (gzipped when asked), standing in for
+    # Blazegraph so that only transport and decoding are measured
+    import gzip
+    import http.server
+    import threading
+
+    variables = list(frame.columns)
+    rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+    bodies = {
+        "text/csv": frame.to_csv(index=False).encode(),
+        "application/sparql-results+json": json.dumps({
+            "head": {"vars": variables},
+            "results": {"bindings": [
+                {v: {"type": "literal", "value": str(x)} for v, x in zip(variables, row)
+                 if x is not None}
+                for row in rows
+            ]},
+        }).encode(),
+        "text/tab-separated-values": (
+            "\t".join("?" + v for v in variables) + "\n"
+            + "".join(
+                "\t".join("" if x is None else json.dumps(str(x)) for x in row) + "\n"
+                for row in rows
+            )
+        ).encode(),
+    }
+    compressed = {accept: gzip.compress(body, 1) for accept, body in bodies.items()}
+
+    class Endpoint(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body in one write, as a real server does, so that
+        # keep-alive connections do not wait on delayed ACKs
+        wbufsize = -1
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            accept = next(a for a in bodies if a in self.headers.get("Accept", ""))
+            use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+            body = compressed[accept] if use_gzip else bodies[accept]
+            self.send_response(200)
+            self.send_header("Content-Type", accept)
+            if use_gzip:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Endpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/blazegraph/sparql" % server.server_address[1]
+
+
+def bench_sparql_transport(rows: int = 200000, endpoint: str = None, runs: int = 3) -> dict:
+    # getAllCulturalHeritageObjects through sparql_dataframe.get and through
+    # the handler transport; without an endpoint a local one serves rows
+    # synthetic objects
+    from sparql_dataframe import get
+    import impl
+
+    server = None
+    if endpoint is None:
+        server, endpoint = _canned_sparql_endpoint(make_objects_frame(rows))
+
+    query = impl.MetadataQueryHandler.all_objects_query.bind()
+    candidates = {"sparql_dataframe.get (CSV)": lambda: get(endpoint, query, True)}
+    for result_format in ("csv", "json", "tsv"):
+        q = impl.MetadataQueryHandler(result_format=result_format)
+        q.setDbPathOrUrl(endpoint)
+        candidates[f"MetadataQueryHandler ({result_format})"] = q.getAllCulturalHeritageObjects
+
+    timings = {}
+    try:
+        for name, run in candidates.items():
+            elapsed = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                df = run()
+                elapsed.append(time.perf_counter() - start)
+            timings[name] = min(elapsed)
+            print(
+                f"{name}: {len(df)} rows in {timings[name]:.2f} s "
+                f"({len(df) / timings[name]:.0f} rows/s)"
+            )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return timings
+
+
+def bench_sparql_latency(calls: int = 300) -> dict:
+    # Many small queries, where connection reuse matters more than decoding
+    from sparql_dataframe import get
+    import impl
+
+    server, endpoint = _canned_sparql_endpoint(make_objects_frame(10))
+    query = impl.MetadataQueryHandler.authors_query.bind(input_id="1")
+    q = impl.MetadataQueryHandler()
+    q.setDbPathOrUrl(endpoint)
+    candidates = {
+        "sparql_dataframe.get (CSV)": lambda: get(endpoint, query, True),
+        "MetadataQueryHandler (csv)": lambda: q.getAuthorsOfCulturalHeritageObject("1"),
+    }
+
+    timings = {}
+    try:
+        for name, run in candidates.items():
+            start = time.perf_counter()
+            for _ in range(calls):
+                run()
+            timings[name] = (time.perf_counter() - start) / calls
+            print(f"{name}: {timings[name] * 1000:.2f} ms/query over {calls} queries")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return timings
+
+
+def bench_entity_memory(count: int = 100000) -> dict:
+    # Bytes allocated per entity instance, including its own attribute
+    # containers (e.g. the tool list) but not the shared string values
+    import tracemalloc
+    import impl
+
+    shared = impl.CulturalHeritageObject("1", "Title", "1700", "Owner", "Place")
+    author = impl.Person("VIAF:1", "Author")
+    factories = {
+        "Person": lambda i: impl.Person("VIAF:1", "Author"),
+        "CulturalHeritageObject": lambda i: impl.Map(
+            "1", "Title", "1700", "Owner", "Place", [author]
+        ),
+        "Acquisition": lambda i: impl.Acquisition(
+            shared, "Institute", "Technique", "Person", "2023", "2024", "Tool"
+        ),
+        "Processing": lambda i: impl.Processing(
+            shared, "Institute", "Person", "Tool", "2023", "2024"
+        ),
+    }
+
+    sizes = {}
+    for name, factory in factories.items():
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        instances = [factory(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # leave out the list holding the instances
+        sizes[name] = (after - before - sys.getsizeof(instances)) / count
+        del instances
+        print(f"{name}: {sizes[name]:.0f} bytes per instance")
+    return sizes
+
+
+if __name__ == "__main__":
+    bench_import_time()
+    bench_process_upload()
+    bench_metadata_conversion()
+    bench_process_queries()
+    bench_mashup_materialization()
+    bench_lazy_results()
+    bench_entity_memory()
+    bench_sparql_transport()
+    bench_sparql_latency()
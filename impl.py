@@ -1,26 +1,477 @@
+import asyncio
+import contextvars
+import csv
+import io
 import os
+import numpy as np
 import pandas as pd
 import re
 import requests
 import sqlite3
 import json
-from rdflib import Graph, URIRef, Literal
+import string
+import textwrap
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pandas import read_csv
-from rdflib.namespace import RDF
-from sparql_dataframe import get
 from pandas import concat
-from rdflib.plugins.stores.sparqlstore import SPARQLUpdateStore
+from requests.adapters import HTTPAdapter
 from typing import List, Union, Optional
+from urllib.request import pathname2url
+
+try:
+    import ijson
+except ImportError:  # optional, _iter_json_array is used instead
+    ijson = None
+
+try:
+    import aiohttp
+except ImportError:  # optional, the async API then runs SPARQL queries on the executor
+    aiohttp = None
 
 BLAZEGRAPH_ENDPOINT = 'http://127.0.0.1:9999/blazegraph/sparql'
 CSV_FILEPATH = 'data/meta.csv'
 
+# Activity tables of the relational database, one for each activity
+# listed in the items of the process JSON file
+ACTIVITY_TYPES = ["Acquisition", "Processing", "Modelling", "Optimising", "Exporting"]
+
+# Number of process JSON items or metadata CSV rows converted at a time
+# before being written to the database
+LOAD_CHUNK_SIZE = 10000
+
+# Number of triples sent to Blazegraph in a single request when uploading
+UPLOAD_BATCH_SIZE = 10000
+
+# Prefixes declared at the top of every SPARQL query, see SparqlTemplate
+SPARQL_PREFIXES = """PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX schema: <https://schema.org/>
+"""
+
+# Number of ids put in the VALUES clause of a single SPARQL query, so that
+# lookups of many objects stay within request size limits
+SPARQL_VALUES_BATCH_SIZE = 500
+# ids bound to the "object_id IN (...)" of a single SQLite query
+SQL_IN_BATCH_SIZE = 500
+
+# Defaults of ResultCache: number of results kept, seconds each of them
+# stays valid and memory all of them may take
+RESULT_CACHE_ENTRIES = 128
+RESULT_CACHE_TTL = 300
+RESULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Resource of the graph database whose schema:version is the data version,
+# the number of uploads so far (see MetadataUploadHandler)
+DATA_VERSION_IRI = "https://github.com/katyakrsn/ds24project/dataVersion"
+
+# Threads a mashup uses to query its handlers at the same time
+MASHUP_WORKERS = 16
+
+# Timeout in seconds and number of retries of a SPARQL query, the
+# defaults of every QueryHandler
+SPARQL_TIMEOUT = 60
+SPARQL_RETRIES = 2
+
 # REMEMBER: before running this code, please run the Blazegraph instance!
 # 
 # Run command:
 #   `java -server -Xmx4g -jar blazegraph.jar`
 
+_http_session = None
+
+
+def _get_http_session() -> requests.Session:
+    # One pooled session for the whole process, so that every request
+    # to Blazegraph reuses an open keep-alive connection
+    global _http_session
+    if _http_session is None:
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # the environment is read once per endpoint by _request_settings
+        # instead of on every request
+        session.trust_env = False
+        _http_session = session
+    return _http_session
+
+
+_endpoint_settings = {}
+
+
+def _request_settings(url: str) -> dict:
+    # Proxies, certificates and .netrc credentials that requests would take
+    # from the environment for url, to be passed to the pooled session
+    settings = _endpoint_settings.get(url)
+    if settings is None:
+        settings = requests.Session().merge_environment_settings(url, {}, None, None, None)
+        del settings["stream"]
+        settings["auth"] = requests.utils.get_netrc_auth(url)
+        _endpoint_settings[url] = settings
+    return settings
+
+
+_XSD = "http://www.w3.org/2001/XMLSchema#"
+_INTEGER_DATATYPES = {
+    _XSD + name
+    for name in (
+        "integer", "int", "long", "short", "byte", "nonNegativeInteger",
+        "positiveInteger", "negativeInteger", "nonPositiveInteger",
+        "unsignedInt", "unsignedLong",
+    )
+}
+_NUMERIC_DATATYPES = _INTEGER_DATATYPES | {
+    _XSD + name for name in ("decimal", "double", "float")
+}
+_SPARQL_ACCEPT = {
+    "csv": "text/csv",
+    "json": "application/sparql-results+json",
+    "tsv": "text/tab-separated-values",
+}
+# Escapes in a TSV result that read_csv cannot decode by itself (it only
+# knows \" and \\)
+_TSV_ESCAPED = re.compile(rb"\\[tnrbfuU]")
+_TSV_TERM = re.compile(r'^"(.*)"(?:@[A-Za-z0-9-]+|\^\^<([^>]*)>)?$', re.S)
+_TSV_ESCAPE = re.compile(r"\\(.)", re.S)
+_TSV_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f"}
+
+
+def _typed_column(values: list, datatypes: set):
+    # Column of SPARQL term values, numeric or boolean when every bound
+    # value has such a datatype and plain strings otherwise
+    if datatypes and datatypes <= _INTEGER_DATATYPES:
+        return pd.to_numeric(pd.Series(values, dtype=object)).astype("Int64")
+    if datatypes and datatypes <= _NUMERIC_DATATYPES:
+        return pd.to_numeric(pd.Series(values, dtype=object))
+    if datatypes == {_XSD + "boolean"}:
+        return pd.Series(
+            [None if value is None else value in ("true", "1") for value in values],
+            dtype=object,
+        )
+    return values
+
+
+def _sparql_json_frame(results: dict) -> pd.DataFrame:
+    # DataFrame of a application/sparql-results+json document
+    variables = results["head"]["vars"]
+    bindings = results["results"]["bindings"]
+    columns = {}
+    for variable in variables:
+        terms = [binding.get(variable) for binding in bindings]
+        columns[variable] = _typed_column(
+            [term["value"] if term else None for term in terms],
+            {term.get("datatype") for term in terms if term},
+        )
+    return pd.DataFrame(columns, columns=variables)
+
+
+def _sparql_tsv_frame(content: bytes) -> pd.DataFrame:
+    # DataFrame of a text/tab-separated-values result. When every cell is a
+    # plain literal or unbound, the C parser of read_csv unquotes them all;
+    # otherwise the terms are decoded one cell at a time
+    if not content.strip():
+        # no header line at all, e.g. the empty answer of some proxies
+        return pd.DataFrame()
+    if len(content) < 1 << 16:
+        # small results are split in Python, cheaper than starting read_csv
+        lines = content.decode("utf-8").split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        rows = [line.rstrip("\r").split("\t") for line in lines]
+        variables = [name.lstrip("?$") for name in rows[0]]
+        return pd.DataFrame(
+            {
+                variable: _tsv_column([row[i] if i < len(row) else "" for row in rows[1:]])
+                for i, variable in enumerate(variables)
+            },
+            columns=variables,
+        )
+
+    header_end = content.find(b"\n") + 1 or len(content)
+    options = dict(sep="\t", dtype=str, keep_default_na=False, skip_blank_lines=False)
+    escaped = content.find(b"\\", header_end) >= 0
+    plain = _tsv_plain(content, header_end) and not (
+        escaped and _TSV_ESCAPED.search(content, header_end)
+    )
+    if plain:
+        # without backslashes read_csv keeps to its fastest quoting mode
+        if escaped:
+            options.update(escapechar="\\", doublequote=False)
+        df = pd.read_csv(
+            io.BytesIO(content), quotechar='"', na_values=[""], **options
+        )
+    else:
+        df = pd.read_csv(
+            io.BytesIO(content), quoting=csv.QUOTE_NONE, na_filter=False, **options
+        )
+        for column in df.columns:
+            df[column] = _tsv_column(df[column].tolist())
+    df.columns = [name.lstrip("?$") for name in df.columns]
+    return df
+
+
+def _tsv_plain(content: bytes, header_end: int) -> bool:
+    # True when every cell after the header is a non-empty plain literal
+    # ("...") or unbound, checked with numpy on the bytes around the
+    # separators: a cell that is not a plain literal (typed or language
+    # tagged literal, IRI, bare number or boolean) does not both start and
+    # end with a quote, and an empty literal starts with two of them.
+    # Bytes up to \r count as separators, which only makes the check stricter
+    body = np.frombuffer(content, np.uint8)[max(header_end - 1, 0):]
+    if len(body) and body[-1] > 13:
+        # a last row without line end
+        body = np.append(body, np.uint8(10))
+    separators = np.flatnonzero(body <= 13)
+    first = body[separators[:-1] + 1]
+    last = body[separators[1:] - 1]
+    if not (((first == 34) | (first <= 13)).all() and ((last == 34) | (last <= 13)).all()):
+        return False
+    starts = separators[:-1][first == 34] + 2
+    return not (body[starts[starts < len(body)]] == 34).any()
+
+
+def _sparql_csv_frame(content: bytes) -> pd.DataFrame:
+    # DataFrame of a text/csv result, with the types read_csv infers, as
+    # sparql_dataframe.get returned them
+    if not content.strip():
+        return pd.DataFrame()
+    return pd.read_csv(io.BytesIO(content))
+
+
+def _sparql_frame(content: bytes, result_format: str) -> pd.DataFrame:
+    if result_format == "csv":
+        return _sparql_csv_frame(content)
+    if result_format == "tsv":
+        return _sparql_tsv_frame(content)
+    return _sparql_json_frame(json.loads(content))
+
+
+def _tsv_column(terms: list):
+    # Values and datatypes of a column of terms in Turtle syntax
+    values, datatypes = [], set()
+    for term in terms:
+        literal = _TSV_TERM.match(term)
+        if not term:
+            values.append(None)
+        elif literal:
+            value = literal.group(1)
+            if "\\" in value:
+                value = _TSV_ESCAPE.sub(
+                    lambda m: _TSV_ESCAPES.get(m.group(1), m.group(1)), value
+                )
+            values.append(value)
+            datatypes.add(literal.group(2))
+        elif term.startswith("<") and term.endswith(">"):
+            values.append(term[1:-1])
+            datatypes.add(None)
+        elif term in ("true", "false"):
+            values.append(term)
+            datatypes.add(_XSD + "boolean")
+        else:
+            # bare numbers are integers, decimals or doubles
+            values.append(term)
+            datatypes.add(_XSD + ("integer" if term.lstrip("+-").isdigit() else "double"))
+    return _typed_column(values, datatypes)
+
+
+def _sparql_select(
+    endpoint: str,
+    query: str,
+    timeout: float = SPARQL_TIMEOUT,
+    retries: int = SPARQL_RETRIES,
+    result_format: str = "csv",
+) -> pd.DataFrame:
+    # Runs a SELECT query on the pooled session (keep-alive, gzip) and
+    # decodes the result straight into a DataFrame; connection errors,
+    # timeouts and 502/503/504 answers are retried with a growing pause
+    session = _get_http_session()
+    headers = {"Accept": _SPARQL_ACCEPT[result_format], "Accept-Encoding": "gzip"}
+    for attempt in range(retries + 1):
+        try:
+            response = session.post(
+                endpoint,
+                data={"query": query},
+                headers=headers,
+                timeout=timeout,
+                **_request_settings(endpoint),
+            )
+            if response.status_code in (502, 503, 504) and attempt < retries:
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            response.raise_for_status()
+            break
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+    return _sparql_frame(response.content, result_format)
+
+
+_aiohttp_sessions = weakref.WeakKeyDictionary()
+
+
+def _get_aiohttp_session() -> "aiohttp.ClientSession":
+    # Same as _get_http_session for the async API, one session for every
+    # event loop since an aiohttp session cannot be shared between loops
+    loop = asyncio.get_running_loop()
+    session = _aiohttp_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=16), trust_env=True
+        )
+        _aiohttp_sessions[loop] = session
+    return session
+
+
+async def _close_aiohttp_session() -> None:
+    session = _aiohttp_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def _sparql_aselect(
+    endpoint: str,
+    query: str,
+    timeout: float = SPARQL_TIMEOUT,
+    retries: int = SPARQL_RETRIES,
+    result_format: str = "csv",
+) -> pd.DataFrame:
+    # _sparql_select without blocking the event loop: the request is sent
+    # with aiohttp when it is installed and by _sparql_select on the default
+    # executor otherwise
+    loop = asyncio.get_running_loop()
+    if aiohttp is None:
+        return await loop.run_in_executor(
+            None, _sparql_select, endpoint, query, timeout, retries, result_format
+        )
+
+    session = _get_aiohttp_session()
+    headers = {"Accept": _SPARQL_ACCEPT[result_format], "Accept-Encoding": "gzip"}
+    for attempt in range(retries + 1):
+        try:
+            async with session.post(
+                endpoint,
+                data={"query": query},
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                if response.status not in (502, 503, 504) or attempt == retries:
+                    response.raise_for_status()
+                    content = await response.read()
+                    break
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+    # large answers are decoded on the executor to keep the loop responsive
+    if len(content) < 1 << 20:
+        return _sparql_frame(content, result_format)
+    return await loop.run_in_executor(None, _sparql_frame, content, result_format)
+
+
+JSON_ERRORS = (ValueError, KeyError, TypeError)
+if ijson:
+    JSON_ERRORS += (ijson.JSONError,)
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# longest token that can be cut off by the end of a read buffer ("\uXXXX")
+_JSON_TOKEN_TAIL = 6
+
+
+def _iter_json_array(json_file, read_size: int = 1 << 16):
+    # Pure-Python incremental parser for a top-level JSON array: only the
+    # current item and one read buffer are kept in memory at any time
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        position = _JSON_WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = json_file.read(read_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+        elif char == "]":
+            return
+        elif char == ",":
+            position += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as err:
+                # only an error at the end of the buffer (or a string still
+                # open there) can be fixed by reading more, any other one is
+                # in the data itself
+                cut_off = (
+                    len(buffer) - err.pos <= _JSON_TOKEN_TAIL
+                    or err.msg.startswith("Unterminated string")
+                )
+                if eof or not cut_off:
+                    raise
+                end = None
+            # the item may be cut off by the end of the buffer, read more
+            if end is None or (end == len(buffer) and not eof):
+                chunk = json_file.read(read_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+            position = end
+
+
+def _nt_literal(values: pd.Series) -> pd.Series:
+    # Plain N-Triples string literals for a whole column of values
+    if values.str.contains(r'[\\"\n\r]', regex=True).any():
+        values = (
+            values.str.replace("\\", "\\\\", regex=False)
+            .str.replace('"', '\\"', regex=False)
+            .str.replace("\n", "\\n", regex=False)
+            .str.replace("\r", "\\r", regex=False)
+        )
+    return '"' + values + '"'
+
+
+def _sparql_literal(value) -> str:
+    # SPARQL string literal for a single value
+    value = str(value)
+    value = value.replace("\\", "\\\\").replace('"', '\\"')
+    return '"' + value.replace("\n", "\\n").replace("\r", "\\r") + '"'
+
+
+def _like_escape(value: str) -> str:
+    # Escapes the LIKE wildcards of value, for use with ESCAPE '\'
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _glob_escape(value: str) -> str:
+    # Escapes the GLOB wildcards of value by putting them in a character class
+    return re.sub(r"([*?\[])", r"[\1]", value)
+
+
 class IdentifiableEntity(object): #Rubens
+    # Entities are created by the million in mashup results, __slots__
+    # keeps them free of a per-instance __dict__
+    __slots__ = ("id",)
+
     def __init__(self, id: str):
         self.id = id
 
@@ -29,6 +480,8 @@ class IdentifiableEntity(object): #Rubens
 
 
 class Person(IdentifiableEntity):  # Rubens
+    __slots__ = ("name",)
+
     def __init__(self, id: str, name: str):
         self.name = name
         super().__init__(id)
@@ -38,6 +491,8 @@ class Person(IdentifiableEntity):  # Rubens
 
 
 class CulturalHeritageObject(IdentifiableEntity):  # Ben
+    __slots__ = ("title", "date", "owner", "place", "hasAuthor")
+
     def __init__(
         self,
         id: str,
@@ -50,19 +505,17 @@ class CulturalHeritageObject(IdentifiableEntity):  # Ben
         author_name: Optional[str] = None,
     ):
         super().__init__(str(id))
-        self.id = id
         self.title = title
         self.date = date
-        self.hasAuthor = hasAuthor or []
         self.owner = str(owner)
         self.place = place
-        self.author_id = author_id
-        self.author_name = author_name
 
-        if type(hasAuthor) == Person:
-            self.hasAuthor.append(Person)
-        elif type(hasAuthor) == list:
-            self.hasAuthor = hasAuthor
+        # author_id and author_name are only a shorthand for a single author
+        if isinstance(hasAuthor, Person):
+            hasAuthor = [hasAuthor]
+        elif hasAuthor is None and author_id and author_name:
+            hasAuthor = [Person(author_id, author_name)]
+        self.hasAuthor = hasAuthor or []
 
     def getTitle(self) -> str:
         return self.title
@@ -83,46 +536,50 @@ class CulturalHeritageObject(IdentifiableEntity):  # Ben
 
 
 class NauticalChart(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class ManuscriptPlate(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class ManuscriptVolume(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class PrintedVolume(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class PrintedMaterial(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class Herbarium(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class Specimen(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class Painting(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class Model(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class Map(CulturalHeritageObject):
-    pass
+    __slots__ = ()
 
 
 class Activity(object):  # Rubens
+    # the object is kept in refers_to, a refersTo attribute would hide
+    # the refersTo() method
+    __slots__ = ("refers_to", "institute", "person", "tool", "start", "end")
+
     def __init__(
         self,
         refersTo: CulturalHeritageObject,
@@ -132,17 +589,18 @@ class Activity(object):  # Rubens
         start: Optional[str],
         end: Union[str, List[str], None],
     ):
-        self.refersTo = refersTo
+        self.refers_to = refersTo
         self.institute = institute
         self.person = person
-        self.tool = []
         self.start = start
         self.end = end
 
         if type(tool) == str:
-            self.tool.append(tool)
+            self.tool = [tool]
         elif type(tool) == list:
             self.tool = tool
+        else:
+            self.tool = []
 
     def getResponsibleInstitute(self) -> str:
         return self.institute
@@ -166,10 +624,12 @@ class Activity(object):  # Rubens
         return None
 
     def refersTo(self) -> CulturalHeritageObject:
-        return self.refersTo
+        return self.refers_to
 
 
 class Acquisition(Activity):
+    __slots__ = ("technique",)
+
     def __init__(
         self,
         refersTo: CulturalHeritageObject,
@@ -188,19 +648,222 @@ class Acquisition(Activity):
 
 
 class Processing(Activity):
-    pass
+    __slots__ = ()
 
 
 class Modelling(Activity):
-    pass
+    __slots__ = ()
 
 
 class Optimising(Activity):
-    pass
+    __slots__ = ()
 
 
 class Exporting(Activity):
-    pass
+    __slots__ = ()
+
+
+# Entity classes by the type names stored in the databases, used by the
+# mashups to materialise query results without if/elif chains
+OBJECT_CLASSES = {
+    cls.__name__: cls
+    for cls in (
+        NauticalChart,
+        ManuscriptPlate,
+        ManuscriptVolume,
+        PrintedVolume,
+        PrintedMaterial,
+        Herbarium,
+        Specimen,
+        Painting,
+        Model,
+        Map,
+    )
+}
+ACTIVITY_CLASSES = {
+    cls.__name__: cls
+    for cls in (Acquisition, Processing, Modelling, Optimising, Exporting)
+}
+
+
+class IdentityMap(object):
+    # One shared instance per id for the people and objects built by a
+    # single mashup call, so that the same author or object is not
+    # allocated again for every row that mentions it. Activities refer to
+    # the object built from its metadata rows when the call has them (they
+    # are built first) and to an empty stub otherwise. Every call gets a
+    # new map, so results returned earlier are never changed and nothing
+    # outlives the result it belongs to.
+    def __init__(self):
+        self.people = {}
+        self.objects = {}
+
+    def getPerson(self, id: str, name: str) -> Person:
+        person = self.people.get(id)
+        if person is None:
+            person = self.people[id] = Person(id, name)
+        elif name and not person.name:
+            person.name = name
+        return person
+
+    def getObjectStub(self, id: str) -> CulturalHeritageObject:
+        obj = self.objects.get(id)
+        if obj is None:
+            obj = self.objects[id] = CulturalHeritageObject(id, "", "", "", "")
+        return obj
+
+    def getObject(
+        self,
+        cls: type,
+        id: str,
+        title: str,
+        date: Optional[str],
+        owner: str,
+        place: str,
+        authors: Optional[List[Person]] = None,
+    ) -> CulturalHeritageObject:
+        # authors are all the authors found in the rows of the object
+        obj = self.objects.get(id)
+        if obj is None:
+            obj = self.objects[id] = cls(id, title, date, owner, place)
+            obj.hasAuthor = list(authors) if authors else []
+        return obj
+
+
+class LazyResult(object):
+    # Read-only sequence over the DataFrame of a query result that creates
+    # entities only when they are accessed. Entity k is built by build()
+    # from the rows offsets[k]:offsets[k + 1], so an object with several
+    # author rows is still a single item. Slices are new LazyResults over
+    # the rows they keep.
+    def __init__(self, df: pd.DataFrame, build, offsets: Optional[np.ndarray] = None):
+        self._df = df.reset_index(drop=True)
+        self._build = build
+        if offsets is None:
+            offsets = np.arange(len(df) + 1)
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = np.arange(len(self))[key]
+            starts = self._offsets[indices]
+            lengths = self._offsets[indices + 1] - starts
+            offsets = np.concatenate(([0], np.cumsum(lengths)))
+            positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+            return LazyResult(self._df.iloc[positions], self._build, offsets)
+
+        index = key + len(self) if key < 0 else key
+        if not 0 <= index < len(self):
+            raise IndexError("LazyResult index out of range")
+        return self._build(
+            self._df.iloc[self._offsets[index]:self._offsets[index + 1]]
+        )[0]
+
+    def __iter__(self):
+        # built a page at a time, so that breaking out of the loop early
+        # leaves the rest of the rows untouched
+        for start in range(0, len(self), 1000):
+            page = self._offsets[start:start + 1001]
+            yield from self._build(self._df.iloc[page[0]:page[-1]])
+
+    def __repr__(self) -> str:
+        return f"<LazyResult of {len(self)} items>"
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return self._df.copy()
+
+
+_result_caches = weakref.WeakSet()
+
+
+def _cache_location(pathOrUrl: str) -> str:
+    # Same string for every spelling of a SQLite path, URLs are kept as they are
+    if "://" in pathOrUrl:
+        return pathOrUrl
+    return os.path.abspath(pathOrUrl)
+
+
+def _invalidate_result_caches(pathOrUrl: str) -> None:
+    # Called by the upload handlers after writing to pathOrUrl
+    for cache in list(_result_caches):
+        cache.invalidate(pathOrUrl)
+
+
+class ResultCache(object):
+    # Data frames returned by the query handlers that use this cache, keyed
+    # on the database and the query that produced them. The least recently
+    # used ones are dropped beyond max_entries or max_bytes, and every one
+    # of them after ttl seconds. Results of a database are dropped as soon
+    # as an upload handler writes to it. Subclasses can keep the data
+    # frames elsewhere by overriding get, put and invalidate
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_ENTRIES,
+        ttl: Optional[float] = RESULT_CACHE_TTL,
+        max_bytes: int = RESULT_CACHE_BYTES,
+        versioned: bool = False,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # with versioned=True the handlers check getDataVersion before using
+        # a result, so uploads done by other processes are noticed too
+        self.versioned = versioned
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires, size, data frame)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        _result_caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key) -> Optional[pd.DataFrame]:
+        # A copy of the data frame stored under key, None when there is
+        # none or it has expired
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[2].copy()
+
+    def put(self, key, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        df = df.copy()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, size, df)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, pathOrUrl: Optional[str] = None) -> None:
+        # Drops the results of the database at pathOrUrl, or all of them
+        with self._lock:
+            if pathOrUrl is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            location = _cache_location(pathOrUrl)
+            for key in [key for key in self._entries if key[0] == location]:
+                self._remove(key)
+
+    def _remove(self, key) -> None:
+        self._bytes -= self._entries.pop(key)[1]
 
 
 class Handler(object):  # Ekaterina
@@ -220,671 +883,1297 @@ class UploadHandler(Handler):  # Ekaterina
         super().__init__()
 
     def pushDataToDb(self, file_path: str) -> bool:
-        self.file_path = file_path
-        blazegraph_endpoint = "http://127.0.0.1:9999/blazegraph/sparql"
-
-
-        # split filepath for file extension
+        # split filepath for file extension and hand the file over to the
+        # handler that knows how to upload it, using our own database
         _, extension = os.path.splitext(file_path)
-        if extension == ".db":
+        if extension == ".json":
             # process json data for SQL database -> upload data to SQL Lite data base
-            process_qh = ProcessDataUploadHandler()
-            result = process_qh.setDbPathOrUrl(self.db_file)
-            
-        elif extension == ".json":
-            # process json data for SQL database -> upload data to SQL Lite data base
-            process_qh = ProcessDataUploadHandler()
-            result = process_qh.setDbPathOrUrl(self.db_file)
-
+            handler = ProcessDataUploadHandler()
         elif extension == ".csv":
             # process csv data & turn into RDF -> upload RDF data to blazegraph store
-            metadata_qh = MetadataUploadHandler()
-            result = metadata_qh.setDbPathOrUrl(blazegraph_endpoint)
-
+            handler = MetadataUploadHandler()
         else:
             raise Exception("Only .json or .csv files can be uploaded!")
-        print("Finished uploading data! ✅")
-        return result
 
+        handler.setDbPathOrUrl(self.dbPathOrUrl)
+        return handler.pushDataToDb(file_path)
 
-class ProcessDataUploadHandler(UploadHandler):  # Ekaterina
-    def __init__(self):
-        super().__init__
 
+class ProcessDataUploadHandler(UploadHandler):  # Ekaterina
+    def __init__(
+        self,
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        cache_size: int = -65536,
+        stream: bool = True,
+        chunk_size: int = LOAD_CHUNK_SIZE,
+        case_insensitive_tools: bool = True,
+        fulltext: bool = False,
+        layout: str = "tables",
+    ):
+        super().__init__()
+        # PRAGMAs used by the connection while loading, cache_size follows
+        # the SQLite convention (negative values are KiB, e.g. 64 MiB). The
+        # journal mode is stored in the database file, so the one it had
+        # before is set again at the end of the load
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        # stream=True parses the JSON array item by item instead of loading
+        # the whole file, rows are inserted every chunk_size items
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # collation of activity_tool.tool, NOCASE unless this is False
+        self.case_insensitive_tools = case_insensitive_tools
+        # also keep the FTS5 table activity_fts in sync with the activities;
+        # once a database has it, every load keeps it in sync
+        self.fulltext = fulltext
+        # "tables" stores each activity type in its own table, "unified"
+        # stores all of them in one 'activity' table with a 'type' column
+        # (plus one view per activity type with the columns of its table)
+        if layout not in ("tables", "unified"):
+            raise ValueError(f"Unknown layout: {layout}")
+        self.layout = layout
 
-    file_path = "data/process.json"
+    def pushDataToDb(self, file_path: str) -> bool:
+        try:
+            json_file = open(file_path, "rb" if self.stream and ijson else "r")
+        except FileNotFoundError:
+            print("Error: JSON file not found.")
+            return False
+
+        result = False
+        conn = None
+        journal_mode = None
+        try:
+            if not self.stream:
+                items = json.load(json_file)
+            elif ijson:
+                items = ijson.items(json_file, "item", use_float=True)
+            else:
+                items = _iter_json_array(json_file)
+
+            conn = sqlite3.connect(self.dbPathOrUrl, isolation_level=None)
+            (journal_mode,) = conn.execute("PRAGMA journal_mode").fetchone()
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+
+            # the rows of a database are all in one layout, the query
+            # handler reads only the one it finds
+            existing_layout = self._existingLayout(conn)
+            if existing_layout not in (None, self.layout):
+                print(
+                    f"Error: the database uses the '{existing_layout}' layout, "
+                    f"it cannot be loaded with layout='{self.layout}'"
+                )
+                return False
+
+            # the whole load runs in a single transaction
+            conn.execute("BEGIN")
+            has_fulltext = self._hasFulltextIndex(conn)
+            fulltext = self.fulltext or has_fulltext
+            self._createTables(conn, fulltext)
+            if fulltext and not has_fulltext:
+                # a new index also covers the activities loaded before
+                self._indexActivities(conn)
+
+            # activity ids are unique across all the activity tables, so
+            # that activity_tool can refer to any of them
+            self._next_activity_id = self._maxActivityId(conn) + 1
+
+            # one batch of rows per activity table (and one for the tools),
+            # inserted with executemany and emptied every chunk_size items
+            if self.layout == "unified":
+                rows = {"activity": []}
+            else:
+                rows = {activity_type: [] for activity_type in ACTIVITY_TYPES}
+            rows["activity_tool"] = []
+            if fulltext:
+                rows["activity_fts"] = []
+            pending = 0
+            for item in items:
+                self._addActivityRows(item, rows)
+                pending += 1
+                if pending >= self.chunk_size:
+                    self._insertActivityRows(conn, rows)
+                    pending = 0
+            self._insertActivityRows(conn, rows)
+
+            # indexes are built once after the bulk insert, not row by row
+            self._createIndexes(conn)
+            # data version read by ProcessDataQueryHandler.getDataVersion,
+            # committed together with the rows
+            (version,) = conn.execute("PRAGMA user_version").fetchone()
+            conn.execute(f"PRAGMA user_version={version + 1}")
+            conn.execute("COMMIT")
+            _invalidate_result_caches(self.dbPathOrUrl)
+            result = True
+
+        except JSON_ERRORS as e:
+            print("Error: invalid process JSON file:", e)
+        except sqlite3.Error as e:
+            print("\nSQLite error:", e)
+        finally:
+            if conn is not None:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                if journal_mode is not None:
+                    self._restoreJournalMode(conn, journal_mode)
+                conn.close()
+            json_file.close()
+
+        if result:
+            print("\nData insertion completed successfully.")
+        return result
 
-    try:
-        with open(file_path) as json_file:
-            data = json.load(json_file)
-    except FileNotFoundError:
-        print("Error: JSON file not found.")
-        exit()
+    def _restoreJournalMode(self, conn: sqlite3.Connection, journal_mode: str) -> None:
+        # e.g. from WAL back to DELETE, so that readers of the database do
+        # not need its -wal and -shm files
+        try:
+            if conn.execute("PRAGMA journal_mode").fetchone()[0] != journal_mode:
+                conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        except sqlite3.Error as e:
+            print("SQLite error restoring the journal mode:", e)
 
-    db_file = "json.db"
+    def _existingLayout(self, conn: sqlite3.Connection) -> Optional[str]:
+        # "unified", "tables" or None for a database without activities yet
+        tables = {
+            name
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        }
+        if "activity" in tables:
+            return "unified"
+        if tables.intersection(ACTIVITY_TYPES):
+            return "tables"
+        return None
 
-    try:
-        conn = sqlite3.connect(db_file)
-        c = conn.cursor()
-
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS Acquisition (
-                        object_id TEXT,
-                        responsible_institute TEXT,
-                        responsible_person TEXT,
-                        technique TEXT,
-                        tool TEXT,
-                        start_date TEXT,
-                        end_date TEXT
-                    )"""
-        )
+    def _hasFulltextIndex(self, conn: sqlite3.Connection) -> bool:
+        query = "SELECT 1 FROM sqlite_master WHERE name = 'activity_fts'"
+        return conn.execute(query).fetchone() is not None
 
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS Processing (
-                        object_id TEXT,
-                        responsible_institute TEXT,
-                        responsible_person TEXT,
-                        tool TEXT,
-                        start_date TEXT,
-                        end_date TEXT
-                    )"""
+    def _indexActivities(self, conn: sqlite3.Connection) -> None:
+        # Adds the activities already in the database to activity_fts
+        if self.layout == "unified":
+            source = (
+                "SELECT activity_id, responsible_institute, responsible_person, "
+                "technique, tool FROM activity"
+            )
+        else:
+            source = " UNION ALL ".join(
+                f"SELECT activity_id, responsible_institute, responsible_person, "
+                f"{'technique' if activity_type == 'Acquisition' else 'NULL'}, "
+                f"tool FROM {activity_type}"
+                for activity_type in ACTIVITY_TYPES
+            )
+        conn.execute(
+            "INSERT INTO activity_fts (rowid, responsible_institute, "
+            "responsible_person, technique, tool) " + source
         )
 
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS Modelling (
-                        object_id TEXT,
-                        responsible_institute TEXT,
-                        responsible_person TEXT,
-                        tool TEXT,
-                        start_date TEXT,
-                        end_date TEXT
-                    )"""
-        )
+    def _createTables(self, conn: sqlite3.Connection, fulltext: bool = False) -> None:
+        if self.layout == "unified":
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS activity (
+                            activity_id INTEGER PRIMARY KEY,
+                            type TEXT,
+                            object_id TEXT,
+                            responsible_institute TEXT,
+                            responsible_person TEXT,
+                            technique TEXT,
+                            tool TEXT,
+                            start_date TEXT,
+                            end_date TEXT
+                        )"""
+            )
 
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS Optimising (
-                        object_id TEXT,
-                        responsible_institute TEXT,
-                        responsible_person TEXT,
-                        tool TEXT,
-                        start_date TEXT,
-                        end_date TEXT
-                    )"""
-        )
+        for activity_type in ACTIVITY_TYPES:
+            technique = "technique TEXT," if activity_type == "Acquisition" else ""
+            if self.layout == "unified":
+                # same name and columns as the table of the "tables" layout
+                conn.execute(
+                    f"""CREATE VIEW IF NOT EXISTS {activity_type} AS
+                            SELECT activity_id, object_id, responsible_institute,
+                                responsible_person, {technique.replace(" TEXT", "")}
+                                tool, start_date, end_date
+                            FROM activity WHERE type = '{activity_type}'"""
+                )
+                continue
+            conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS {activity_type} (
+                            activity_id INTEGER PRIMARY KEY,
+                            object_id TEXT,
+                            responsible_institute TEXT,
+                            responsible_person TEXT,
+                            {technique}
+                            tool TEXT,
+                            start_date TEXT,
+                            end_date TEXT
+                        )"""
+            )
 
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS Exporting (
-                        object_id TEXT,
-                        responsible_institute TEXT,
-                        responsible_person TEXT,
-                        tool TEXT,
-                        start_date TEXT,
-                        end_date DATE
+        # one row per tool used in an activity, instead of matching the
+        # comma-joined tool column with LIKE '%tool%'
+        tool_collation = "COLLATE NOCASE" if self.case_insensitive_tools else ""
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS activity_tool (
+                        activity_id INTEGER,
+                        tool TEXT {tool_collation}
                     )"""
         )
 
-        for item in data:
-            object_id = item["object id"]
-
-            acquisition = item["acquisition"]
-            c.execute(
-                """INSERT INTO Acquisition (object_id, responsible_institute, responsible_person, technique, tool, start_date, end_date)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    object_id,
-                    acquisition["responsible institute"],
-                    acquisition["responsible person"],
-                    acquisition["technique"],
-                    ", ".join(acquisition["tool"]) if acquisition["tool"] else None,
-                    acquisition["start date"],
-                    acquisition["end date"],
-                ),
+        if fulltext:
+            # contentless full-text index of the text columns, its rowid is
+            # the activity_id of the indexed activity
+            conn.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS activity_fts USING fts5 (
+                            responsible_institute,
+                            responsible_person,
+                            technique,
+                            tool,
+                            content='',
+                            prefix='2 3'
+                        )"""
             )
 
-            processing = item["processing"]
-            c.execute(
-                """INSERT INTO Processing (object_id, responsible_institute, responsible_person, tool, start_date, end_date)
-                        VALUES (?, ?, ?, ?, ?, ?)""",
-                (
-                    object_id,
-                    processing["responsible institute"],
-                    processing["responsible person"],
-                    ", ".join(processing["tool"]) if processing["tool"] else None,
-                    processing["start date"],
-                    processing["end date"],
-                ),
-            )
+    def _maxActivityId(self, conn: sqlite3.Connection) -> int:
+        if self.layout == "unified":
+            (max_id,) = conn.execute("SELECT MAX(activity_id) FROM activity").fetchone()
+            return max_id or 0
+        query = " UNION ALL ".join(
+            f"SELECT MAX(activity_id) AS id FROM {activity_type}"
+            for activity_type in ACTIVITY_TYPES
+        )
+        (max_id,) = conn.execute(f"SELECT MAX(id) FROM ({query})").fetchone()
+        return max_id or 0
+
+    def _createIndexes(self, conn: sqlite3.Connection) -> None:
+        # one index for every column the query handlers filter on, names and
+        # techniques are matched case-insensitively so they use NOCASE
+        tables = ["activity"] if self.layout == "unified" else ACTIVITY_TYPES
+        for activity_type in tables:
+            indexes = {
+                "object_id": "object_id",
+                "institute": "responsible_institute COLLATE NOCASE",
+                "person": "responsible_person COLLATE NOCASE",
+                "end_date": "end_date",
+                # also serves the searches on start_date alone
+                "dates": "start_date, end_date",
+            }
+            if activity_type in ("Acquisition", "activity"):
+                indexes["technique"] = "technique COLLATE NOCASE"
+            for name, columns in indexes.items():
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{activity_type}_{name} "
+                    f"ON {activity_type} ({columns})"
+                )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_tool ON activity_tool (tool)")
+
+    def _addActivityRows(self, item: dict, rows: dict) -> None:
+        object_id = item["object id"]
+        for activity_type in ACTIVITY_TYPES:
+            activity = item[activity_type.lower()]
+            activity_id = self._next_activity_id
+            self._next_activity_id += 1
+
+            tool = ", ".join(activity["tool"]) if activity["tool"] else None
+            for tool_name in activity["tool"] or []:
+                rows["activity_tool"].append((activity_id, tool_name))
+
+            if "activity_fts" in rows:
+                rows["activity_fts"].append(
+                    (
+                        activity_id,
+                        activity["responsible institute"],
+                        activity["responsible person"],
+                        activity.get("technique"),
+                        tool,
+                    )
+                )
 
-            modelling = item["modelling"]
-            c.execute(
-                """INSERT INTO Modelling (object_id, responsible_institute, responsible_person, tool, start_date, end_date)
-                        VALUES (?, ?, ?, ?, ?, ?)""",
-                (
-                    object_id,
-                    modelling["responsible institute"],
-                    modelling["responsible person"],
-                    ", ".join(modelling["tool"]) if modelling["tool"] else None,
-                    modelling["start date"],
-                    modelling["end date"],
-                ),
-            )
+            if self.layout == "unified":
+                rows["activity"].append(
+                    (
+                        activity_id,
+                        activity_type,
+                        object_id,
+                        activity["responsible institute"],
+                        activity["responsible person"],
+                        activity.get("technique"),
+                        tool,
+                        activity["start date"],
+                        activity["end date"],
+                    )
+                )
+                continue
 
-            optimising = item["optimising"]
-            c.execute(
-                """INSERT INTO Optimising (object_id, responsible_institute, responsible_person, tool, start_date, end_date)
-                        VALUES (?, ?, ?, ?, ?, ?)""",
-                (
+            if activity_type == "Acquisition":
+                row = (
+                    activity_id,
                     object_id,
-                    optimising["responsible institute"],
-                    optimising["responsible person"],
-                    ", ".join(optimising["tool"]) if optimising["tool"] else None,
-                    optimising["start date"],
-                    optimising["end date"],
-                ),
-            )
-
-            exporting = item["exporting"]
-            c.execute(
-                """INSERT INTO Exporting (object_id, responsible_institute, responsible_person, tool, start_date, end_date)
-                        VALUES (?, ?, ?, ?, ?, ?)""",
-                (
+                    activity["responsible institute"],
+                    activity["responsible person"],
+                    activity["technique"],
+                    tool,
+                    activity["start date"],
+                    activity["end date"],
+                )
+            else:
+                row = (
+                    activity_id,
                     object_id,
-                    exporting["responsible institute"],
-                    exporting["responsible person"],
-                    ", ".join(exporting["tool"]) if exporting["tool"] else None,
-                    exporting["start date"],
-                    exporting["end date"],
-                ),
-            )
-        conn.commit()
-
-    except sqlite3.Error as e:
-        print("\nSQLite error:", e)
-    finally:
-        conn.close()
-    print("\nData insertion and querying completed successfully.")
-
+                    activity["responsible institute"],
+                    activity["responsible person"],
+                    tool,
+                    activity["start date"],
+                    activity["end date"],
+                )
+            rows[activity_type].append(row)
+
+    def _insertActivityRows(self, conn: sqlite3.Connection, rows: dict) -> None:
+        for activity_type, batch in rows.items():
+            if not batch:
+                continue
+            if activity_type == "activity_tool":
+                query = "INSERT INTO activity_tool (activity_id, tool) VALUES (?, ?)"
+            elif activity_type == "activity_fts":
+                query = """INSERT INTO activity_fts (rowid, responsible_institute, responsible_person, technique, tool)
+                            VALUES (?, ?, ?, ?, ?)"""
+            elif activity_type == "activity":
+                query = """INSERT INTO activity (activity_id, type, object_id, responsible_institute, responsible_person, technique, tool, start_date, end_date)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+            elif activity_type == "Acquisition":
+                query = """INSERT INTO Acquisition (activity_id, object_id, responsible_institute, responsible_person, technique, tool, start_date, end_date)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+            else:
+                query = f"""INSERT INTO {activity_type} (activity_id, object_id, responsible_institute, responsible_person, tool, start_date, end_date)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)"""
+            conn.executemany(query, batch)
+            batch.clear()
 
 
 class MetadataUploadHandler(UploadHandler):  # Ekaterina
-    def __init__(self):
-        super().__init__
-
-    my_graph = Graph()
-
-    # Classes of resources of CulturalHeritageObject
-    NauticalChart = URIRef("https://schema.org/NauticalChart")
-    ManuscriptPlate = URIRef("https://schema.org/ManuscriptPlate")
-    ManuscriptVolume = URIRef("https://schema.org/ManuscriptVolume")
-    PrintedVolume = URIRef("https://schema.org/PrintedVolume")
-    PrintedMaterial = URIRef("https://schema.org/PrintedMaterial")
-    Herbarium = URIRef("https://schema.org/Herbarium")
-    Specimen = URIRef("https://schema.org/Specimen")
-    Painting = URIRef("https://schema.org/Painting")
-    Model = URIRef("https://schema.org/Model")
-    Map = URIRef("https://schema.org/Map")
-    Author = URIRef("https://schema.org/Author")
+    def __init__(
+        self,
+        batch_size: int = UPLOAD_BATCH_SIZE,
+        bulk_load: bool = False,
+        chunk_size: int = LOAD_CHUNK_SIZE,
+    ):
+        super().__init__()
+        # bulk_load=False sends SPARQL 'INSERT DATA' updates, bulk_load=True
+        # posts N-Triples bodies to the Blazegraph REST endpoint instead
+        self.batch_size = batch_size
+        self.bulk_load = bulk_load
+        # number of CSV rows converted to triples at a time
+        self.chunk_size = chunk_size
+        self.throughput = 0.0
+
+    # Classes of resources of CulturalHeritageObject, by value of the 'Type' column
+    class_uris = {
+        "Nautical chart": "<https://schema.org/NauticalChart>",
+        "Manuscript plate": "<https://schema.org/ManuscriptPlate>",
+        "Manuscript volume": "<https://schema.org/ManuscriptVolume>",
+        "Printed volume": "<https://schema.org/PrintedVolume>",
+        "Printed material": "<https://schema.org/PrintedMaterial>",
+        "Herbarium": "<https://schema.org/Herbarium>",
+        "Specimen": "<https://schema.org/Specimen>",
+        "Painting": "<https://schema.org/Painting>",
+        "Model": "<https://schema.org/Model>",
+        "Map": "<https://schema.org/Map>",
+    }
+    # Common class of all of them, and the literal naming the class of each
+    # object, so that queries need neither a FILTER on the class nor string
+    # functions to name it
+    heritage_object = "<https://schema.org/CulturalHeritageObject>"
+    type_name = "<https://schema.org/additionalType>"
+    Author = "<https://schema.org/Author>"
+    rdf_type = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
 
     # Attributes related to classes
-    title = URIRef("https://schema.org/name")
-    date = URIRef("https://schema.org/dateCreated")
-    owner = URIRef("https://schema.org/provider")
-    place = URIRef("https://schema.org/contentLocation")
-    identifier = URIRef("https://schema.org/identifier")
-    label = URIRef("http://www.w3.org/2000/01/rdf-schema#label")
+    title = "<https://schema.org/name>"
+    date = "<https://schema.org/dateCreated>"
+    owner = "<https://schema.org/provider>"
+    place = "<https://schema.org/contentLocation>"
+    identifier = "<https://schema.org/identifier>"
+    label = "<http://www.w3.org/2000/01/rdf-schema#label>"
 
     # Relations among classes
-    hasAuthor = URIRef("https://schema.org/creator")
+    hasAuthor = "<https://schema.org/creator>"
 
     # This is the string defining the base URL used to define
     # the URLs of all the resources created from the data
     base_url = "https://github.com/katyakrsn/ds24project/"
 
-    file_path_csv = "data/meta.csv"
-    heritage = read_csv(
-        file_path_csv,
-        keep_default_na=False,  # Prevent pandas from treating certain values as NaN
-        dtype={
-            "Id": "string",
-            "Type": "string",
-            "Title": "string",
-            "Date": "string",
-            "Author": "string",
-            "Owner": "string",
-            "Place": "string",
-        },
-    )
+    bump_version_update = SPARQL_PREFIXES + f"""
+        DELETE {{ <{DATA_VERSION_IRI}> schema:version ?version }}
+        INSERT {{ <{DATA_VERSION_IRI}> schema:version ?next }}
+        WHERE {{
+            OPTIONAL {{ <{DATA_VERSION_IRI}> schema:version ?version }}
+            BIND(COALESCE(?version + 1, 1) AS ?next)
+        }}
+        """
+
+    def pushDataToDb(self, file_path: str) -> bool:
+        try:
+            heritage = read_csv(
+                file_path,
+                keep_default_na=False,  # Prevent pandas from treating certain values as NaN
+                dtype={
+                    "Id": "string",
+                    "Type": "string",
+                    "Title": "string",
+                    "Date": "string",
+                    "Author": "string",
+                    "Owner": "string",
+                    "Place": "string",
+                },
+                chunksize=self.chunk_size,
+            )
+        except FileNotFoundError:
+            print("Error: CSV file not found.")
+            return False
+
+        def lines():
+            for chunk in heritage:
+                yield from self._chunkToTriples(chunk).tolist()
+
+        try:
+            with heritage:
+                self.uploadTriples(lines())
+        except pd.errors.ParserError as e:
+            print("Error: invalid metadata CSV file:", e)
+            return False
+        except requests.RequestException as e:
+            print("Error uploading triples to Blazegraph:", e)
+            return False
+
+        print("Finished uploading data! ✅")
+        return True
 
-    # Iterate over each row in the CSV file
-    for idx, row in heritage.iterrows():
-        # Determine the class URI based on the type of CulturalHeritageObject
-        class_uri = None
-        if row["Type"] == "Nautical chart":
-            class_uri = NauticalChart
-        elif row["Type"] == "Manuscript plate":
-            class_uri = ManuscriptPlate
-        elif row["Type"] == "Manuscript volume":
-            class_uri = ManuscriptVolume
-        elif row["Type"] == "Printed volume":
-            class_uri = PrintedVolume
-        elif row["Type"] == "Printed material":
-            class_uri = PrintedMaterial
-        elif row["Type"] == "Herbarium":
-            class_uri = Herbarium
-        elif row["Type"] == "Specimen":
-            class_uri = Specimen
-        elif row["Type"] == "Painting":
-            class_uri = Painting
-        elif row["Type"] == "Model":
-            class_uri = Model
-        elif row["Type"] == "Map":
-            class_uri = Map
-
-        # Create a URI for the resource using the base URL and the row ID
-        resource_uri = URIRef(f"{base_url}{row['Id']}")
+    def _chunkToTriples(self, chunk: pd.DataFrame) -> pd.Series:
+        # Builds the N-Triples statements of a chunk of CSV rows, a whole
+        # column at a time instead of row by row
+        resource_uri = "<" + self.base_url + chunk["Id"] + ">"
+        class_uri = chunk["Type"].map(self.class_uris)
+        known_type = class_uri.notna()
+        if not known_type.all():
+            print(f"Unknown Type in {(~known_type).sum()} rows")
 
         # Handle missing date values by assigning a default value
-        if not row["Date"]:
-            row["Date"] = "Unknown"
-            print(f"Missing Date at index {idx}")
-
-        # Add triples to the graph
-        my_graph.add((resource_uri, RDF.type, class_uri))
-        my_graph.add((resource_uri, identifier, Literal(row["Id"])))
-        my_graph.add((resource_uri, title, Literal(row["Title"])))
-        my_graph.add((resource_uri, date, Literal(row["Date"])))
-        my_graph.add((resource_uri, owner, Literal(row["Owner"])))
-        my_graph.add((resource_uri, place, Literal(row["Place"])))
-
-        if row["Author"]:
-            # Split the text into two parts
-            text_parts = row["Author"].split(" (")
-            author = row["Author"]
-            text_before_parentheses = author.split(" (")[0]
-            authorID = re.findall(r"\((.*?)\)", author)
-            authorID = authorID[0] if authorID else "noID"
-            authorIRI = base_url + text_before_parentheses.replace(" ", "_").replace(
-                ",", ""
+        missing_date = chunk["Date"] == ""
+        if missing_date.any():
+            print(f"Missing Date in {missing_date.sum()} rows")
+        date = chunk["Date"].mask(missing_date, "Unknown")
+
+        typed_uri = resource_uri[known_type]
+        class_uri = class_uri[known_type]
+        # "<https://schema.org/NauticalChart>" -> "NauticalChart"
+        class_name = class_uri.str.slice(len("<https://schema.org/"), -1)
+
+        triples = [
+            typed_uri + f" {self.rdf_type} " + class_uri + " .",
+            typed_uri + f" {self.rdf_type} {self.heritage_object} .",
+            typed_uri + f" {self.type_name} " + _nt_literal(class_name) + " .",
+            resource_uri + f" {self.identifier} " + _nt_literal(chunk["Id"]) + " .",
+            resource_uri + f" {self.title} " + _nt_literal(chunk["Title"]) + " .",
+            resource_uri + f" {self.date} " + _nt_literal(date) + " .",
+            resource_uri + f" {self.owner} " + _nt_literal(chunk["Owner"]) + " .",
+            resource_uri + f" {self.place} " + _nt_literal(chunk["Place"]) + " .",
+        ]
+
+        has_author = chunk["Author"] != ""
+        if not has_author.all():
+            print(f"Missing Author in {(~has_author).sum()} rows")
+        author = chunk["Author"][has_author]
+        if len(author):
+            # "Surname, Name (VIAF:123)" -> name, id and IRI of the author
+            author_name = author.str.partition(" (")[0]
+            author_id = author.str.extract(r"\((.*?)\)", expand=False).fillna("noID")
+            author_uri = (
+                "<"
+                + self.base_url
+                + author_name.str.replace(" ", "_", regex=False).str.replace(
+                    ",", "", regex=False
+                )
+                + ">"
             )
+            triples += [
+                resource_uri[has_author] + f" {self.hasAuthor} " + author_uri + " .",
+                (
+                    author_uri + f" {self.identifier} " + _nt_literal(author_id) + " ."
+                ).drop_duplicates(),
+                (author_uri + f" {self.rdf_type} {self.Author} .").drop_duplicates(),
+                (
+                    author_uri + f" {self.label} " + _nt_literal(author_name) + " ."
+                ).drop_duplicates(),
+            ]
+
+        return concat(triples, ignore_index=True)
+
+    def uploadTriples(self, lines) -> int:
+        # lines is an iterable of N-Triples statements, sent in batches of
+        # batch_size triples per request instead of one request per triple
+        session = _get_http_session()
+        uploaded = 0
+        batch = []
+        start = time.perf_counter()
 
-            my_graph.add((resource_uri, hasAuthor, URIRef(authorIRI)))
-            my_graph.add((URIRef(authorIRI), identifier, Literal(authorID)))
-            my_graph.add((URIRef(authorIRI), RDF.type, Author))
-            my_graph.add((URIRef(authorIRI), label, Literal(text_before_parentheses)))
+        try:
+            for line in lines:
+                batch.append(line)
+                if len(batch) >= self.batch_size:
+                    self._postBatch(session, batch)
+                    uploaded += len(batch)
+                    batch = []
+            if batch:
+                self._postBatch(session, batch)
+                uploaded += len(batch)
+        finally:
+            # also after a failed batch, the ones before it are stored
+            version_error = None
+            if uploaded:
+                version_error = self._bumpDataVersion(session)
+                _invalidate_result_caches(self.dbPathOrUrl)
+        # versioned caches of other processes only see the new triples
+        # through the version, so failing to update it fails the upload
+        if version_error is not None:
+            raise version_error
+
+        elapsed = time.perf_counter() - start
+        self.throughput = uploaded / elapsed if elapsed > 0 else float(uploaded)
+        print(
+            f"Uploaded {uploaded} triples in {elapsed:.2f} s "
+            f"({self.throughput:.0f} triples/s)"
+        )
+        return uploaded
+
+    def _bumpDataVersion(
+        self, session: requests.Session
+    ) -> Optional[requests.RequestException]:
+        # Adds one to the data version read by
+        # MetadataQueryHandler.getDataVersion, in a single update retried
+        # like the queries (an update applied twice still changes the
+        # version); the error is returned when every attempt failed
+        for attempt in range(SPARQL_RETRIES + 1):
+            try:
+                response = session.post(
+                    self.dbPathOrUrl,
+                    data={"update": self.bump_version_update},
+                    **_request_settings(self.dbPathOrUrl),
+                )
+                response.raise_for_status()
+                return None
+            except requests.RequestException as e:
+                error = e
+                if attempt < SPARQL_RETRIES:
+                    time.sleep(0.5 * 2 ** attempt)
+        print("Error updating the data version:", error)
+        return error
+
+    def _postBatch(self, session: requests.Session, batch: List[str]) -> None:
+        body = "\n".join(batch)
+        if self.bulk_load:
+            response = session.post(
+                self.dbPathOrUrl,
+                data=body.encode("utf-8"),
+                headers={"Content-Type": "text/plain; charset=utf-8"},
+                **_request_settings(self.dbPathOrUrl),
+            )
         else:
-            row["Author"] = "Unknown"
-            print(f"Missing Author at index {idx}")
-
-    my_graph.serialize(destination="output_triples.ttl", format="ttl")
-
-    # Initialize SPARQLUpdateStore to interact with Blazegraph
-    store = SPARQLUpdateStore()
-    endpoint = "http://127.0.0.1:9999/blazegraph/sparql"
-    store.open((endpoint, endpoint))
-    # Upload triples to the Blazegraph database
-    for triple in my_graph.triples((None, None, None)):
-        store.add(triple)
-    store.close()
-
-    sparql_query = f"""
-        SELECT ?subject ?predicate ?object
-    WHERE {{
-        ?subject ?predicate ?object .
-    }}
-    ORDER BY ASC(xsd:integer(REPLACE(str(?subject), "{base_url}", "")))
-    """
-    sparql_endpoint = "http://127.0.0.1:9999/blazegraph/sparql"
-
-    # Send the SPARQL query to the Blazegraph endpoint
-    response = requests.post(sparql_endpoint, data={"query": sparql_query})
-    if response.status_code != 200:
-        print(f"Error: {response.status_code} - {response.reason}")
+            response = session.post(
+                self.dbPathOrUrl,
+                data={"update": f"INSERT DATA {{\n{body}\n}}"},
+                **_request_settings(self.dbPathOrUrl),
+            )
+        response.raise_for_status()
 
-class QueryHandler(Handler):
-    def __init__(self):
-        super().__init__()
 
-    def getById(self, input_id: str) -> pd.DataFrame:  # Ekaterina/Rubens
-        endpoint = self.blazegraph_endpoint
-        id_author_query = f"""
-        PREFIX rdf:  <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX schema: <https://schema.org/>
+class SparqlTemplate(object):
+    # SPARQL query text built once, with the shared prefixes in front. Its
+    # $name placeholders are only ever replaced by escaped literals, and a
+    # list of values becomes the content of a VALUES block, so no id can
+    # change the structure of the query
+    def __init__(self, query: str):
+        self.template = string.Template(SPARQL_PREFIXES + textwrap.dedent(query))
+
+    def bind(self, **values) -> str:
+        literals = {}
+        for name, value in values.items():
+            if isinstance(value, (list, tuple)):
+                literals[name] = " ".join(_sparql_literal(v) for v in value)
+            else:
+                literals[name] = _sparql_literal(value)
+        return self.template.substitute(literals)
+
+
+# True while a mashup calls a handler: query errors are then raised for the
+# mashup to report, instead of being printed and returned as empty results
+_mashup_call = contextvars.ContextVar("_mashup_call", default=False)
+
+
+def _call_from_mashup(method, *args):
+    token = _mashup_call.set(True)
+    try:
+        return method(*args)
+    finally:
+        _mashup_call.reset(token)
+
 
+class QueryHandler(Handler):
+    by_id_query = SparqlTemplate("""
         SELECT ?identifier ?name ?title
-        WHERE {{
-            ?entity schema:identifier "{input_id}" .
+        WHERE {
+            ?entity schema:identifier $input_id .
             ?entity schema:creator ?Author .
             ?Author rdfs:label ?name .
             ?Author schema:identifier ?identifier .
             ?entity schema:name ?title
-        }}
-        """
-        df_sparql = get(endpoint, id_author_query, True)
+        }
+        """)
+
+    def __init__(
+        self,
+        timeout: float = SPARQL_TIMEOUT,
+        retries: int = SPARQL_RETRIES,
+        result_format: str = "csv",
+        cache: Optional[ResultCache] = None,
+    ):
+        super().__init__()
+        # transport policy for the endpoint of this handler, result_format
+        # is "csv" (untyped, the fastest to decode), "json" or "tsv"
+        if result_format not in _SPARQL_ACCEPT:
+            raise ValueError(f"Unknown SPARQL result format: {result_format}")
+        self.timeout = timeout
+        self.retries = retries
+        self.result_format = result_format
+        # results are kept in cache when one is given, several handlers
+        # can share the same ResultCache
+        self.cache = cache
+
+    data_version_query = SparqlTemplate(f"""
+        SELECT ?version
+        WHERE {{ <{DATA_VERSION_IRI}> schema:version ?version }}
+        """)
+
+    def getById(self, input_id: str) -> pd.DataFrame:  # Ekaterina/Rubens
+        id_author_query = self.by_id_query.bind(input_id=input_id)
+        df_sparql = self._select(id_author_query)
         return df_sparql
 
+    def getDataVersion(self) -> int:
+        # Number of uploads to the database so far, 0 before the first one;
+        # a single triple is read, so it is a cheap way of telling whether
+        # the data changed since a result was computed
+        df = _sparql_select(
+            self.dbPathOrUrl,
+            self.data_version_query.bind(),
+            self.timeout,
+            self.retries,
+            self.result_format,
+        )
+        return self._dataVersion(df)
+
+    async def agetById(self, input_id: str) -> pd.DataFrame:
+        return await self._aselect(self.by_id_query.bind(input_id=input_id))
+
+    async def agetDataVersion(self) -> int:
+        df = await _sparql_aselect(
+            self.dbPathOrUrl,
+            self.data_version_query.bind(),
+            self.timeout,
+            self.retries,
+            self.result_format,
+        )
+        return self._dataVersion(df)
+
+    def _dataVersion(self, df: pd.DataFrame) -> int:
+        if "version" not in df.columns or df["version"].isna().all():
+            return 0
+        return int(pd.to_numeric(df["version"]).max())
+
+    async def aclose(self) -> None:
+        # Closes the aiohttp session of the running loop, the next async
+        # query opens a new one
+        if aiohttp is not None:
+            await _close_aiohttp_session()
+
+    def _select(self, query: str) -> pd.DataFrame:
+        key = None
+        if self.cache is not None:
+            key = self._cacheKey(query)
+            df = self.cache.get(key)
+            if df is not None:
+                return df
+
+        df = _sparql_select(
+            self.dbPathOrUrl, query, self.timeout, self.retries, self.result_format
+        )
+        if key is not None:
+            self.cache.put(key, df)
+        return df
+
+    async def _aselect(self, query: str) -> pd.DataFrame:
+        key = None
+        if self.cache is not None:
+            key = (_cache_location(self.dbPathOrUrl), query)
+            if self.cache.versioned:
+                key += (await self.agetDataVersion(),)
+            df = self.cache.get(key)
+            if df is not None:
+                return df
+
+        df = await _sparql_aselect(
+            self.dbPathOrUrl, query, self.timeout, self.retries, self.result_format
+        )
+        if key is not None:
+            self.cache.put(key, df)
+        return df
+
+    def _cacheKey(self, *parts) -> tuple:
+        # Key of a result of this handler in self.cache, ending with the
+        # data version when the cache is versioned: results of an older
+        # version are no longer found and age out of the cache
+        key = (_cache_location(self.dbPathOrUrl),) + parts
+        if self.cache.versioned:
+            key += (self.getDataVersion(),)
+        return key
+
+    async def _arun(self, method, *args):
+        # Runs a blocking method of this handler on the default executor
+        # of the running loop, in a copy of the context of the caller
+        return await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, method, *args
+        )
+
 
 class MetadataQueryHandler(QueryHandler):
-    def __init__(self):
-        self.blazegraph_endpoint = BLAZEGRAPH_ENDPOINT
-        self.csv_file_path = CSV_FILEPATH
-
-    def getAllPeople(self) -> pd.DataFrame:  # Rubens
-        sparql_query = """
-        PREFIX schema: <https://schema.org/>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        
+    all_people_query = SparqlTemplate("""
         SELECT ?id ?name
         WHERE {
             ?entity schema:creator ?Author .
             ?Author rdfs:label ?name .
             ?Author schema:identifier ?id .
         }
-        """
-        df_sparql = get(self.blazegraph_endpoint, sparql_query, True)
-        return df_sparql
-
-    def getAllCulturalHeritageObjects(self) -> pd.DataFrame:  # Ekaterina
-        endpoint = self.blazegraph_endpoint
-        cultural_object_query = """
-        PREFIX rdf:  <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX schema: <https://schema.org/>
-
-        SELECT (REPLACE(STR(?type), "https://schema.org/", "") AS ?type_name) ?id ?title ?date ?owner ?place ?author_id ?author_name
+        """)
+    # Objects are found through their common class and name their own
+    # class with schema:additionalType, see MetadataUploadHandler
+    all_objects_query = SparqlTemplate("""
+        SELECT ?type_name ?id ?title ?date ?owner ?place ?author_id ?author_name
         WHERE {
-        ?cultural_object rdf:type ?type .
-        ?cultural_object schema:name ?title .
-        OPTIONAL { ?cultural_object schema:identifier ?id }
-        OPTIONAL { ?cultural_object schema:dateCreated ?date }
-        OPTIONAL { ?cultural_object schema:provider ?owner }
-        OPTIONAL { ?cultural_object schema:contentLocation ?place }
-        OPTIONAL { ?cultural_object schema:creator ?author }
-        OPTIONAL { ?author schema:identifier ?author_id }
-        OPTIONAL { ?author rdfs:label ?author_name }
-        
-        FILTER(?type IN (
-        <https://schema.org/NauticalChart>,
-        <https://schema.org/ManuscriptPlate>,
-        <https://schema.org/ManuscriptVolume>,
-        <https://schema.org/PrintedVolume>,
-        <https://schema.org/PrintedMaterial>,
-        <https://schema.org/Herbarium>,
-        <https://schema.org/Specimen>,
-        <https://schema.org/Painting>,
-        <https://schema.org/Model>,
-        <https://schema.org/Map>
-        ))
-        FILTER(?author_name != "NaN")
-        FILTER(?author_id != "NaN")
+            ?cultural_object rdf:type schema:CulturalHeritageObject .
+            ?cultural_object schema:additionalType ?type_name .
+            ?cultural_object schema:identifier ?id .
+            ?cultural_object schema:name ?title .
+            ?cultural_object schema:dateCreated ?date .
+            ?cultural_object schema:provider ?owner .
+            ?cultural_object schema:contentLocation ?place .
+            OPTIONAL {
+                ?cultural_object schema:creator ?author .
+                ?author schema:identifier ?author_id .
+                ?author rdfs:label ?author_name .
+            }
         }
-        """
-        df_sparql = get(endpoint, cultural_object_query, True)
-        return df_sparql
-
-    def getAuthorsOfCulturalHeritageObject(self, input_id) -> pd.DataFrame:  # Rubens
-        endpoint = self.blazegraph_endpoint
-        id_author_query = f"""
-        PREFIX rdf:  <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX schema: <https://schema.org/>
-
+        """)
+    objects_by_ids_query = SparqlTemplate("""
+        SELECT ?type_name ?id ?title ?date ?owner ?place ?author_id ?author_name
+        WHERE {
+            VALUES ?id { $input_ids }
+            ?cultural_object schema:identifier ?id .
+            ?cultural_object rdf:type schema:CulturalHeritageObject .
+            ?cultural_object schema:additionalType ?type_name .
+            ?cultural_object schema:name ?title .
+            ?cultural_object schema:dateCreated ?date .
+            ?cultural_object schema:provider ?owner .
+            ?cultural_object schema:contentLocation ?place .
+            OPTIONAL {
+                ?cultural_object schema:creator ?author .
+                ?author schema:identifier ?author_id .
+                ?author rdfs:label ?author_name .
+            }
+        }
+        """)
+    authors_query = SparqlTemplate("""
         SELECT ?id ?name
-        WHERE {{
-            ?entity schema:identifier "{input_id}" .
+        WHERE {
+            ?entity schema:identifier $input_id .
             ?entity schema:creator ?Author .
             ?Author rdfs:label ?name .
             ?Author schema:identifier ?id .
-        }}
-        """
-        df_sparql = get(endpoint, id_author_query, True)
-        return df_sparql
-
-    def getCulturalHeritageObjectsAuthoredBy(
-        self, input_id
-    ) -> pd.DataFrame:  # Ekaterina
-        endpoint = self.blazegraph_endpoint
-        id_cultural_query = f"""
-        PREFIX rdf:  <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX schema: <https://schema.org/>
-
-        SELECT ?object ?type_name ?id ?title ?date ?owner ?place ?name ?author_id
-            WHERE {{
-            ?entity schema:identifier "{input_id}" .
+        }
+        """)
+    authors_by_ids_query = SparqlTemplate("""
+        SELECT ?object_id ?id ?name
+        WHERE {
+            VALUES ?object_id { $input_ids }
+            ?entity schema:identifier ?object_id .
             ?entity schema:creator ?Author .
+            ?Author rdfs:label ?name .
+            ?Author schema:identifier ?id .
+        }
+        """)
+    authored_by_query = SparqlTemplate("""
+        SELECT ?object ?type_name ?id ?title ?date ?owner ?place ?name ?author_id
+        WHERE {
+            VALUES ?author_id { $input_id }
+            ?Author schema:identifier ?author_id .
             ?object schema:creator ?Author .
-            ?object rdf:type ?type .
+            ?object rdf:type schema:CulturalHeritageObject .
+            ?object schema:additionalType ?type_name .
             ?object schema:name ?title .
             ?object schema:identifier ?id .
             ?object schema:dateCreated ?date .
             ?object schema:provider ?owner .
             ?object schema:contentLocation ?place .
-            OPTIONAL {{
-                ?object schema:creator ?Author .
-                ?Author rdfs:label ?name .
-                ?Author schema:identifier ?author_id .
-            }}
-            BIND(REPLACE(STR(?type), "https://schema.org/", "") AS ?type_name)
-            FILTER(?type IN (
-                    <https://schema.org/NauticalChart>,
-                    <https://schema.org/ManuscriptPlate>,
-                    <https://schema.org/ManuscriptVolume>,
-                    <https://schema.org/PrintedVolume>,
-                    <https://schema.org/PrintedMaterial>,
-                    <https://schema.org/Herbarium>,
-                    <https://schema.org/Specimen>,
-                    <https://schema.org/Painting>,
-                    <https://schema.org/Model>,
-                    <https://schema.org/Map>
-                    ))
-            }}
-            """
-
-        df_sparql = get(endpoint, id_cultural_query, True)
-        df_sparql.drop_duplicates(inplace=True)
+            OPTIONAL { ?Author rdfs:label ?name }
+        }
+        """)
+
+    def __init__(
+        self,
+        timeout: float = SPARQL_TIMEOUT,
+        retries: int = SPARQL_RETRIES,
+        result_format: str = "csv",
+        cache: Optional[ResultCache] = None,
+    ):
+        super().__init__(timeout, retries, result_format, cache)
+        self.dbPathOrUrl = BLAZEGRAPH_ENDPOINT
+        self.csv_file_path = CSV_FILEPATH
+
+    def getAllPeople(self) -> pd.DataFrame:  # Rubens
+        sparql_query = self.all_people_query.bind()
+        df_sparql = self._select(sparql_query)
         return df_sparql
 
+    def getAllCulturalHeritageObjects(self) -> pd.DataFrame:  # Ekaterina
+        cultural_object_query = self.all_objects_query.bind()
+        df_sparql = self._select(cultural_object_query)
+        return df_sparql
 
-class ProcessDataQueryHandler(QueryHandler):
-    def __init__(self):
-        super().__init__()
+    def getCulturalHeritageObjectsByIds(
+        self, input_ids, batch_size: int = SPARQL_VALUES_BATCH_SIZE
+    ) -> pd.DataFrame:
+        # Same columns as getAllCulturalHeritageObjects for the given ids only,
+        # the ids are bound with VALUES so Blazegraph looks them up in its
+        # identifier index instead of returning every object
+        return self._queryByIds(
+            self.objects_by_ids_query,
+            input_ids,
+            batch_size,
+            ["type_name", "id", "title", "date", "owner", "place", "author_id", "author_name"],
+        )
 
-    def getById(self, id: str):  # Rubens
-        return pd.DataFrame()
+    def getAuthorsOfCulturalHeritageObject(self, input_id) -> pd.DataFrame:  # Rubens
+        id_author_query = self.authors_query.bind(input_id=input_id)
+        df_sparql = self._select(id_author_query)
+        return df_sparql
 
-    def getAllActivities(self) -> pd.DataFrame:  # Rubens
-        db_file = "json.db"
-        try:
-            conn = sqlite3.connect(db_file)
-
-            # Use LIKE operator to match partially with the technique string
-            query = """
-                SELECT object_id, responsible_institute, responsible_person, technique, NULL as tool, start_date, end_date, 'Acquisition' as type  FROM Acquisition
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Processing' as type  FROM Processing
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Modelling' as type  FROM Modelling
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Optimising' as type  FROM Optimising
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Exporting' as type  FROM Exporting
-            """
-            df = pd.read_sql_query(query, conn)
-            return df
+    def getAuthorsOfCulturalHeritageObjects(
+        self, input_ids, batch_size: int = SPARQL_VALUES_BATCH_SIZE
+    ) -> pd.DataFrame:
+        # Same as getAuthorsOfCulturalHeritageObject for many objects at once,
+        # one query for every batch_size ids; object_id tells them apart
+        return self._queryByIds(
+            self.authors_by_ids_query, input_ids, batch_size, ["object_id", "id", "name"]
+        )
 
+    def getCulturalHeritageObjectsAuthoredBy(
+        self, input_id
+    ) -> pd.DataFrame:  # Ekaterina
+        id_cultural_query = self.authored_by_query.bind(input_id=input_id)
+
+        df_sparql = self._select(id_cultural_query)
+        df_sparql.drop_duplicates(inplace=True)
+        return df_sparql
+
+    # Async counterparts of the methods above, for use in an event loop
+
+    async def agetAllPeople(self) -> pd.DataFrame:
+        return await self._aselect(self.all_people_query.bind())
+
+    async def agetAllCulturalHeritageObjects(self) -> pd.DataFrame:
+        return await self._aselect(self.all_objects_query.bind())
+
+    async def agetCulturalHeritageObjectsByIds(
+        self, input_ids, batch_size: int = SPARQL_VALUES_BATCH_SIZE
+    ) -> pd.DataFrame:
+        return await self._aqueryByIds(
+            self.objects_by_ids_query,
+            input_ids,
+            batch_size,
+            ["type_name", "id", "title", "date", "owner", "place", "author_id", "author_name"],
+        )
+
+    async def agetAuthorsOfCulturalHeritageObject(self, input_id) -> pd.DataFrame:
+        return await self._aselect(self.authors_query.bind(input_id=input_id))
+
+    async def agetAuthorsOfCulturalHeritageObjects(
+        self, input_ids, batch_size: int = SPARQL_VALUES_BATCH_SIZE
+    ) -> pd.DataFrame:
+        return await self._aqueryByIds(
+            self.authors_by_ids_query, input_ids, batch_size, ["object_id", "id", "name"]
+        )
+
+    async def agetCulturalHeritageObjectsAuthoredBy(self, input_id) -> pd.DataFrame:
+        df_sparql = await self._aselect(self.authored_by_query.bind(input_id=input_id))
+        df_sparql.drop_duplicates(inplace=True)
+        return df_sparql
+
+    def _queryByIds(
+        self, template: SparqlTemplate, input_ids, batch_size: int, columns: List[str]
+    ) -> pd.DataFrame:
+        # Runs template once for every batch_size distinct ids
+        ids = list(dict.fromkeys(str(input_id) for input_id in input_ids))
+        frames = [
+            self._select(template.bind(input_ids=ids[start:start + batch_size]))
+            for start in range(0, len(ids), batch_size)
+        ]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return concat(frames, ignore_index=True)
+
+    async def _aqueryByIds(
+        self, template: SparqlTemplate, input_ids, batch_size: int, columns: List[str]
+    ) -> pd.DataFrame:
+        # Same as _queryByIds with all the batches sent at once
+        ids = list(dict.fromkeys(str(input_id) for input_id in input_ids))
+        frames = await asyncio.gather(*(
+            self._aselect(template.bind(input_ids=ids[start:start + batch_size]))
+            for start in range(0, len(ids), batch_size)
+        ))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return concat(frames, ignore_index=True)
+
+
+class _ThreadConnection(object):
+    # Connection of one thread of a ProcessDataQueryHandler
+    __slots__ = ("conn", "generation", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.generation = generation
+
+
+def _release_connection(conn: sqlite3.Connection, connections: set, lock) -> None:
+    with lock:
+        connections.discard(conn)
+    conn.close()
+
+
+class ProcessDataQueryHandler(QueryHandler):
+    def __init__(
+        self,
+        read_only: bool = True,
+        mmap_size: int = 256 * 1024 * 1024,
+        cached_statements: int = 256,
+        cache: Optional[ResultCache] = None,
+    ):
+        super().__init__(cache=cache)
+        # Each thread keeps its own connection to dbPathOrUrl open between
+        # calls: read_only opens it with mode=ro, mmap_size enables
+        # memory-mapped reads and cached_statements is the number of
+        # prepared statements kept by each connection
+        self.read_only = read_only
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._generation = 0
+
+    def setDbPathOrUrl(self, pathOrUrl: str) -> bool:
+        self.close()
+        return super().setDbPathOrUrl(pathOrUrl)
+
+    def close(self) -> None:
+        # Closes the connections of all threads, they are opened again
+        # on their next query
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            self._generation += 1
+
+    def getById(self, id: str):  # Rubens
+        return pd.DataFrame()
+
+    def getDataVersion(self) -> int:
+        # user_version of the database, ProcessDataUploadHandler adds one
+        # to it with every load
+        try:
+            (version,) = self._connection().execute("PRAGMA user_version").fetchone()
         except sqlite3.Error as e:
             print("SQLite error:", e)
-        finally:
-            conn.close()
+            return 0
+        return version
+
+    def getAllActivities(self) -> pd.DataFrame:  # Rubens
+        return self._query(*self._activitiesQuery())
 
     def getActivitiesByResponsibleInstitution(
-        self, institution_str: str
+        self, institution_str: str, match_mode: str = "contains"
     ) -> pd.DataFrame:  # Ekaterina
-        db_file = "json.db"
-        try:
-            conn = sqlite3.connect(db_file)
-
-            # Use LIKE operator to match partially with the technique string
-            query = """
-                SELECT object_id, responsible_institute, responsible_person, technique, NULL as tool, start_date, end_date, 'Acquisition' as type  FROM Acquisition WHERE responsible_institute LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Processing' as type  FROM Processing WHERE responsible_institute LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Modelling' as type  FROM Modelling WHERE responsible_institute LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Optimising' as type  FROM Optimising WHERE responsible_institute LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Exporting' as type  FROM Exporting WHERE responsible_institute LIKE ?
-            """
-            like_param = f"%{institution_str}%"
-            params = (like_param, like_param, like_param, like_param, like_param)
-
-            # Fetch the data using pandas
-            df = pd.read_sql_query(query, conn, params=params)
-            return df
-
-        except sqlite3.Error as e:
-            print("SQLite error:", e)
-        finally:
-            conn.close()
+        return self._query(
+            *self._activitiesQuery(
+                *self._matchCondition("responsible_institute", institution_str, match_mode)
+            )
+        )
 
     def getActivitiesByResponsiblePerson(
-        self, responsible_person_str: str
+        self, responsible_person_str: str, match_mode: str = "contains"
     ) -> pd.DataFrame:  # Ben
-        db_file = "json.db"
-        try:
-            conn = sqlite3.connect(db_file)
-
-            # Use LIKE operator to match partially with the technique string
-            query = """
-                SELECT object_id, responsible_institute, responsible_person, technique, NULL as tool, start_date, end_date, 'Acquisition' as type  FROM Acquisition WHERE responsible_person LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Processing' as type  FROM Processing WHERE responsible_person LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Modelling' as type  FROM Modelling WHERE responsible_person LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Optimising' as type  FROM Optimising WHERE responsible_person LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Exporting' as type  FROM Exporting WHERE responsible_person LIKE ?
-            """
-            like_param = f"%{responsible_person_str}%"
-            params = (like_param, like_param, like_param, like_param, like_param)
-
-            df = pd.read_sql_query(query, conn, params=params)
-            return df
-
-        except sqlite3.Error as e:
-            print("SQLite error:", e)
-        finally:
-            conn.close()
-
-    def getActivitiesUsingTool(self, tool_str: str) -> pd.DataFrame:  # Rubens
-        db_file = "json.db"
+        return self._query(
+            *self._activitiesQuery(
+                *self._matchCondition(
+                    "responsible_person", responsible_person_str, match_mode
+                )
+            )
+        )
 
-        try:
-            conn = sqlite3.connect(db_file)
-
-            # Use LIKE operator to match partially with the tool string
-            query = """
-                SELECT object_id, responsible_institute, responsible_person, technique, NULL as tool, start_date, end_date, 'Acquisition' as type  FROM Acquisition WHERE tool LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Processing' as type  FROM Processing WHERE tool LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Modelling' as type  FROM Modelling WHERE tool LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Optimising' as type  FROM Optimising WHERE tool LIKE ?
-                UNION
-                SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Exporting' as type  FROM Exporting WHERE tool LIKE ?
-            """
-            like_param = f"%{tool_str}%"
-            params = (like_param, like_param, like_param, like_param, like_param)
-
-            df = pd.read_sql_query(query, conn, params=params)
-            return df
+    def getActivitiesUsingTool(
+        self, tool_str: str, match_mode: str = "exact", case_sensitive: bool = False
+    ) -> pd.DataFrame:  # Rubens
+        # "exact" and "prefix" are indexed lookups of whole tool names in
+        # activity_tool, case_sensitive adds a BINARY check on top of them
+        if match_mode == "exact":
+            condition = "tool = ?"
+            params = (tool_str,)
+            if case_sensitive:
+                condition += " AND tool = ? COLLATE BINARY"
+                params += (tool_str,)
+        elif match_mode == "prefix":
+            condition = "tool LIKE ? ESCAPE '\\'"
+            params = (_like_escape(tool_str) + "%",)
+            if case_sensitive:
+                condition += " AND tool GLOB ?"
+                params += (_glob_escape(tool_str) + "*",)
+        else:
+            return self._query(
+                *self._activitiesQuery(*self._matchCondition("tool", tool_str, match_mode))
+            )
 
-        except sqlite3.Error as e:
-            print("SQLite error:", e)
-        finally:
-            conn.close()
+        return self._query(
+            *self._activitiesQuery(
+                f"activity_id IN (SELECT activity_id FROM activity_tool WHERE {condition})",
+                params,
+            )
+        )
 
     def getActivitiesStartedAfter(self, start_date: str) -> pd.DataFrame:  # Amanda
-        db_file = "json.db"
+        return self._query(*self._activitiesQuery("start_date >= ?", (start_date,)))
 
-        try:
-            conn = sqlite3.connect(db_file)
-            query = """
-            SELECT object_id, responsible_institute, responsible_person, technique, NULL as tool, start_date, end_date, 'Acquisition' as type 
-            FROM Acquisition WHERE start_date >= ? 
-            UNION 
-            SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Processing' as type 
-            FROM Processing WHERE start_date >= ? 
-            UNION 
-            SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Modelling' as type 
-            FROM Modelling WHERE start_date >= ? 
-            UNION 
-            SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Optimising' as type 
-            FROM Optimising WHERE start_date >= ? 
-            UNION 
-            SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Exporting' as type 
-            FROM Exporting WHERE start_date >= ?
-            """
-            df = pd.read_sql_query(
-                query,
-                conn,
-                params=(start_date, start_date, start_date, start_date, start_date),
+    def getActivitiesEndedBefore(self, end_date: str) -> pd.DataFrame:  # Amanda
+        return self._query(*self._activitiesQuery("end_date <= ?", (end_date,)))
+
+    def getAcquisitionsByTechnique(
+        self, technique_str: str, match_mode: str = "contains"
+    ) -> pd.DataFrame:  # Rubens
+        return self._query(
+            *self._activitiesQuery(
+                *self._matchCondition("technique", technique_str, match_mode),
+                ["Acquisition"],
             )
-            return df
+        )
 
-        except sqlite3.Error as e:
-            print("SQLite error:", e)
-        finally:
-            conn.close()
+    def getActivitiesOnObjects(
+        self, input_ids, batch_size: int = SQL_IN_BATCH_SIZE
+    ) -> pd.DataFrame:
+        # Activities on the objects with the given ids, looked up in the
+        # object_id index batch_size ids at a time
+        ids = list(dict.fromkeys(str(input_id) for input_id in input_ids))
+        frames = []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            condition = "object_id IN (" + ", ".join("?" * len(batch)) + ")"
+            frames.append(self._query(*self._activitiesQuery(condition, tuple(batch))))
+        if not frames:
+            return pd.DataFrame(columns=[
+                "object_id", "responsible_institute", "responsible_person",
+                "technique", "tool", "start_date", "end_date", "type",
+            ])
+        return concat(frames, ignore_index=True)
+
+    # Async counterparts of the methods above, SQLite is queried on the
+    # default executor where every thread keeps its own connection
+
+    async def agetById(self, id: str) -> pd.DataFrame:
+        return await self._arun(self.getById, id)
+
+    async def agetDataVersion(self) -> int:
+        return await self._arun(self.getDataVersion)
+
+    async def agetAllActivities(self) -> pd.DataFrame:
+        return await self._arun(self.getAllActivities)
+
+    async def agetActivitiesByResponsibleInstitution(
+        self, institution_str: str, match_mode: str = "contains"
+    ) -> pd.DataFrame:
+        return await self._arun(
+            self.getActivitiesByResponsibleInstitution, institution_str, match_mode
+        )
 
-    def getActivitiesEndedBefore(self, end_date: str) -> pd.DataFrame:  # Amanda
-        db_file = "json.db"
+    async def agetActivitiesByResponsiblePerson(
+        self, responsible_person_str: str, match_mode: str = "contains"
+    ) -> pd.DataFrame:
+        return await self._arun(
+            self.getActivitiesByResponsiblePerson, responsible_person_str, match_mode
+        )
 
-        try:
-            conn = sqlite3.connect(db_file)
+    async def agetActivitiesUsingTool(
+        self, tool_str: str, match_mode: str = "exact", case_sensitive: bool = False
+    ) -> pd.DataFrame:
+        return await self._arun(
+            self.getActivitiesUsingTool, tool_str, match_mode, case_sensitive
+        )
 
-            # Construct the SQL query with NULL columns where necessary
-            query = (
-                "SELECT object_id, responsible_institute, responsible_person, technique, NULL as tool, start_date, end_date, 'Acquisition' as type FROM Acquisition WHERE end_date <= ? UNION "
-                "SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Processing' as type FROM Processing WHERE end_date <= ? UNION "
-                "SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Modelling' as type FROM Modelling WHERE end_date <= ? UNION "
-                "SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Optimising' as type  FROM Optimising WHERE end_date <= ? UNION "
-                "SELECT object_id, responsible_institute, responsible_person, NULL as technique, NULL as tool, start_date, end_date, 'Exporting' as type FROM Exporting WHERE end_date <= ?"
-            )
+    async def agetActivitiesStartedAfter(self, start_date: str) -> pd.DataFrame:
+        return await self._arun(self.getActivitiesStartedAfter, start_date)
 
-            df = pd.read_sql_query(
-                query, conn, params=(end_date, end_date, end_date, end_date, end_date)
-            )
-            return df
+    async def agetActivitiesEndedBefore(self, end_date: str) -> pd.DataFrame:
+        return await self._arun(self.getActivitiesEndedBefore, end_date)
 
-        except sqlite3.Error as e:
-            print("SQLite error:", e)
-        finally:
-            conn.close()
+    async def agetAcquisitionsByTechnique(
+        self, technique_str: str, match_mode: str = "contains"
+    ) -> pd.DataFrame:
+        return await self._arun(self.getAcquisitionsByTechnique, technique_str, match_mode)
 
-    def getAcquisitionsByTechnique(self, technique_str: str) -> pd.DataFrame:  # Rubens
-        db_file = "json.db"
+    async def agetActivitiesOnObjects(
+        self, input_ids, batch_size: int = SQL_IN_BATCH_SIZE
+    ) -> pd.DataFrame:
+        return await self._arun(self.getActivitiesOnObjects, input_ids, batch_size)
+
+    def getQueryPlan(self, method_name: str, *args) -> pd.DataFrame:
+        # Output of EXPLAIN QUERY PLAN for the SQL that the query method
+        # method_name runs with args, e.g. to check which indexes it uses
+        self._local.explain = True
         try:
-            conn = sqlite3.connect(db_file)
+            return getattr(self, method_name)(*args)
+        finally:
+            self._local.explain = False
+
+    def _matchCondition(self, column: str, value: str, match_mode: str) -> tuple:
+        # WHERE condition and params matching column against value:
+        #   "contains"  LIKE '%value%', needs a full scan
+        #   "exact"     whole value, case-insensitive, uses the NOCASE index
+        #   "prefix"    values starting with value, uses the NOCASE index
+        #   "fulltext"  every word of value as a word prefix, uses activity_fts
+        if match_mode == "contains":
+            return f"{column} LIKE ?", (f"%{value}%",)
+        if match_mode == "exact":
+            return f"{column} = ? COLLATE NOCASE", (value,)
+        if match_mode == "prefix":
+            return f"{column} LIKE ? ESCAPE '\\'", (_like_escape(value) + "%",)
+        if match_mode == "fulltext":
+            if not self._hasTable("activity_fts"):
+                print("No full-text index in the database, using 'contains' instead")
+                return self._matchCondition(column, value, "contains")
+            if not value.split():
+                # FTS5 has no query for "no words", match them as 'contains'
+                return self._matchCondition(column, value, "contains")
+            words = " AND ".join(
+                '"' + word.replace('"', '""') + '"*' for word in value.split()
+            )
+            return (
+                "activity_id IN (SELECT rowid FROM activity_fts WHERE activity_fts MATCH ?)",
+                (f"{column} : ({words})",),
+            )
+        raise ValueError(f"Unknown match_mode: {match_mode}")
 
-            # Use LIKE operator to match partially with the technique string
-            query = f"SELECT * FROM Acquisition WHERE technique LIKE ?"
+    def _hasTable(self, name: str) -> bool:
+        try:
+            query = "SELECT 1 FROM sqlite_master WHERE name = ?"
+            return self._connection().execute(query, (name,)).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+    def _activitiesQuery(
+        self, condition: str = "", params: tuple = (), activity_types=ACTIVITY_TYPES
+    ) -> tuple:
+        if self._hasTable("activity"):
+            # "unified" layout: a single scan of the activity table
+            query = (
+                "SELECT object_id, responsible_institute, responsible_person, "
+                "technique, tool, start_date, end_date, type FROM activity"
+            )
+            conditions = [condition] if condition else []
+            if len(activity_types) < len(ACTIVITY_TYPES):
+                types = ", ".join(f"'{activity_type}'" for activity_type in activity_types)
+                conditions.append(f"type IN ({types})")
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            return query, tuple(params)
+
+        # One SELECT per activity table with the same columns. The condition
+        # is the same for all of them, so its parameters are numbered (?1,
+        # ?2, ...) and bound once instead of once per table, which keeps
+        # the statement within the variable limit of SQLite
+        numbers = iter(range(1, len(params) + 1))
+        condition = re.sub(r"\?", lambda match: f"?{next(numbers)}", condition)
+        selects = []
+        for activity_type in activity_types:
+            technique = "technique" if activity_type == "Acquisition" else "NULL"
+            query = (
+                f"SELECT object_id, responsible_institute, responsible_person, "
+                f"{technique} AS technique, tool, start_date, end_date, "
+                f"'{activity_type}' AS type FROM {activity_type}"
+            )
+            if condition:
+                query += f" WHERE {condition}"
+            selects.append(query)
+        return "\nUNION ALL\n".join(selects), tuple(params)
+
+    def _query(self, query: str, params: tuple = ()) -> pd.DataFrame:
+        key = None
+        if getattr(self._local, "explain", False):
+            query = "EXPLAIN QUERY PLAN " + query
+        elif self.cache is not None:
+            key = self._cacheKey(query, tuple(params))
+            df = self.cache.get(key)
+            if df is not None:
+                return df
 
-            # Execute the query and pass the technique_str wrapped with '%' for partial match
-            df = pd.read_sql_query(query, conn, params=("%" + technique_str + "%",))
+        try:
+            df = pd.read_sql_query(query, self._connection(), params=params)
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            if _mashup_call.get():
+                raise
+            print("SQLite error:", e)
+            return pd.DataFrame()
+        # errors are not kept, the next call tries again
+        if key is not None:
+            self.cache.put(key, df)
+        return df
+
+    def _connection(self) -> sqlite3.Connection:
+        holder = getattr(self._local, "conn", None)
+        if holder is not None and holder.generation == self._generation:
+            return holder.conn
+
+        path = os.path.abspath(self.dbPathOrUrl)
+        uri = "file:" + pathname2url(path) + ("?mode=ro" if self.read_only else "")
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        with self._lock:
+            self._connections.add(conn)
+            holder = _ThreadConnection(conn, self._generation)
+        # the thread-local holder goes away with its thread, and so does
+        # the connection instead of staying open until close(); replacing
+        # an older holder releases its connection, which takes the lock
+        weakref.finalize(holder, _release_connection, conn, self._connections, self._lock)
+        self._local.conn = holder
+        return conn
 
-            # Add the type column
-            df["type"] = "Acquisition"
-            return df
 
-        except sqlite3.Error as e:
-            print("SQLite error:", e)
-        finally:
-            conn.close()
+# Errors of a handler that leave its results out of a mashup instead of
+# failing the whole call
+_HANDLER_ERRORS = (requests.RequestException, sqlite3.Error, pd.errors.DatabaseError)
+if aiohttp is not None:
+    _HANDLER_ERRORS += (aiohttp.ClientError,)
 
 
 class BasicMashup(object):
@@ -892,9 +2181,22 @@ class BasicMashup(object):
         self,
         metadataQuery: List[MetadataQueryHandler],
         processQuery: List[ProcessDataQueryHandler],
+        lazy: bool = False,
+        timeout: Optional[float] = None,
     ) -> None:  # Rubens
         self.metadataQuery = metadataQuery if metadataQuery is not None else []
         self.processQuery = processQuery if processQuery is not None else []
+        # with lazy=True objects and activities are returned as LazyResult
+        # instead of lists
+        self.lazy = lazy
+        # seconds every handler has to answer, the results of the ones that
+        # take longer are left out; None waits for all of them
+        self.timeout = timeout
+        # threads querying the handlers at once, started on first use and
+        # kept for the life of the mashup so that the handlers can keep
+        # their per-thread connections
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     def cleanMetadataHandlers(self) -> bool:  # Rubens
         self.metadataQuery.clear()
@@ -913,1318 +2215,662 @@ class BasicMashup(object):
         return True
 
     def getEntityById(self, id: str) -> IdentifiableEntity | None:  # Rubens
-        id_entity: List[Person] = []
-        processed_ids = set()  # Set to keep track of processed IDs
-
-        for handler in self.metadataQuery:
-            people_df = handler.getById(id)
-            for _, row in people_df.iterrows():
-                person_id = row["identifier"]
-                # Check if the ID has already been processed
-                if person_id not in processed_ids:
-                    person = Person(id=person_id, name=row["name"])
-                id_entity.append(person)
-                processed_ids.add(person_id)  # Add the ID to the set of processed IDs
-
-        print("Entity found by Id:")
-        for person in id_entity:
-            print(
-                f"Name: {person.name}, Id: {person.id}, Type: {type(person).__name__}"
-            )
+        people_df = self._fanOut(self.metadataQuery, "getById", id)
+        id_entity = self._uniquePeople(people_df, "identifier")
+
+        print(f"Entity found by Id: {len(id_entity)} people")
         if id_entity == []:
             id_entity = None
-            
+
         return id_entity
 
     def getAllPeople(self) -> List[Person]:  # Ben/Rubens
-        all_people: List[Person] = []
-        processed_ids = set()  # Set to keep track of processed IDs
-
-        for handler in self.metadataQuery:
-            people_df = handler.getAllPeople()
-            for _, row in people_df.iterrows():
-                person_id = row["id"]
-                # Check if the ID has already been processed
-                if person_id not in processed_ids:
-                    person = Person(id=person_id, name=row["name"])
-                    all_people.append(person)
-                    processed_ids.add(
-                        person_id
-                    )  # Add the ID to the set of processed IDs
-
-        print("Person list created:")
-        for person in all_people:
-            print(f"Name: {person.name}, Type: {type(person).__name__}")
+        people_df = self._fanOut(self.metadataQuery, "getAllPeople")
+        all_people = self._uniquePeople(people_df)
+
+        print(f"Person list created: {len(all_people)} people")
         return all_people
 
     def getAllCulturalHeritageObjects(
         self,
     ) -> List[CulturalHeritageObject]:  # Ekaterina
-        objects_list = []
-        df = pd.DataFrame()
+        objects_list = self._noResults()
 
         if len(self.metadataQuery) > 0:
-            df = self.metadataQuery[0].getAllCulturalHeritageObjects()
-            print("DataFrame returned from SPARQL query:")
-
-        if df.empty:
-            print("The DataFrame is empty.")
-        else:
-            for _, row in df.iterrows():
-                id = str(row["id"])
-                title = row["title"]
-                date = row["date"]
-                owner = str(row["owner"])
-                place = row["place"]
-                author_id = str(row["author_id"])
-                author_name = row["author_name"]
-
-                hasAuthor = None
-                if author_id and author_name:
-                    hasAuthor = [Person(author_id, author_name)]
-
-                try:
-                    # Use if-elif-else to instantiate objects based on type name
-                    type_name = row["type_name"]
-                    if type_name == "NauticalChart":
-                        obj = NauticalChart(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "ManuscriptPlate":
-                        obj = ManuscriptPlate(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "ManuscriptVolume":
-                        obj = ManuscriptVolume(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "PrintedVolume":
-                        obj = PrintedVolume(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "PrintedMaterial":
-                        obj = PrintedMaterial(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Herbarium":
-                        obj = Herbarium(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Specimen":
-                        obj = Specimen(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Painting":
-                        obj = Painting(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Model":
-                        obj = Model(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Map":
-                        obj = Map(id, title, date, owner, place, hasAuthor)
-                    else:
-                        print(f"No class defined for type: {type_name}")
-
-                    # Append the instantiated object to the list
-                    objects_list.append(obj)
-                except ValueError as e:
-                    print(f"Error creating CulturalHeritageObject: {e}")
-
-            print("Objects list created:")
-            for obj in objects_list:
-                print(
-                    f"Object ID: {obj.id}, Title: {obj.title}, Type: {obj.__class__.__name__}, hasAuthor: {', '.join([f'{author.name} ({author.id})' for author in obj.hasAuthor]) if obj.hasAuthor else 'None'}"
-                )
+            df = self._fanOut(self.metadataQuery, "getAllCulturalHeritageObjects")
+            if df.empty:
+                print("The DataFrame is empty.")
+            objects_list = self._objectsFromDataFrame(df)
 
+        print(f"Objects list created: {len(objects_list)} objects")
         return objects_list
 
     def getAuthorsOfCulturalHeritageObject(
         self, object_id: str
     ) -> List[Person]:  # Ekaterina
-        authors_list = []
-
-        for metadata_qh in self.metadataQuery:
-            authors_df = metadata_qh.getAuthorsOfCulturalHeritageObject(object_id)
-            print(authors_df)
-
-            for _, row in authors_df.iterrows():
-                author = Person(row["id"], row["name"])
-                authors_list.append(author)
-
-        return authors_list
+        authors_df = self._fanOut(
+            self.metadataQuery, "getAuthorsOfCulturalHeritageObject", object_id
+        )
+        # the same author can be found by several handlers
+        return self._uniquePeople(authors_df)
 
     def getCulturalHeritageObjectsAuthoredBy(
         self, input_id: str
     ) -> List[CulturalHeritageObject]:  # Ekaterina
-        objects_list = []
-        df = pd.DataFrame()
+        objects_list = self._noResults()
 
         if len(self.metadataQuery) > 0:
-            df = self.metadataQuery[0].getCulturalHeritageObjectsAuthoredBy(input_id)
-            print("DataFrame returned from SPARQL query:")
-            print(df)
-
-        if not df.empty:
-            for _, row in df.iterrows():
-                id = str(row["id"])
-                title = row["title"]
-                date = str(row["date"])
-                owner = str(row["owner"])
-                place = row["place"]
-                author_id = str(row["author_id"]) if "author_id" in df.columns else None
-                author_name = (
-                    row["author_name"] if "author_name" in df.columns else None
-                )
-
-                hasAuthor = None
-                if author_id and author_name:
-                    hasAuthor = [Person(author_id, author_name)]
-
-                try:
-                    # Use if-elif-else to instantiate objects based on type name
-                    type_name = row["type_name"]
-                    if type_name == "NauticalChart":
-                        obj = NauticalChart(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "ManuscriptPlate":
-                        obj = ManuscriptPlate(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "ManuscriptVolume":
-                        obj = ManuscriptVolume(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "PrintedVolume":
-                        obj = PrintedVolume(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "PrintedMaterial":
-                        obj = PrintedMaterial(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Herbarium":
-                        obj = Herbarium(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Specimen":
-                        obj = Specimen(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Painting":
-                        obj = Painting(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Model":
-                        obj = Model(id, title, date, owner, place, hasAuthor)
-                    elif type_name == "Map":
-                        obj = Map(id, title, date, owner, place, hasAuthor)
-                    else:
-                        print(f"No class defined for type: {type_name}")
-                        continue
-
-                    # Append the instantiated object to the list
-                    objects_list.append(obj)
-                except ValueError as e:
-                    print(f"Error creating CulturalHeritageObject: {e}")
-
-            print("Objects list created:")
-            for obj in objects_list:
-                print(
-                    f"Object ID: {obj.id}, Title: {obj.title}, Type: {type(obj).__name__}"
-                )
+            df = self._fanOut(
+                self.metadataQuery, "getCulturalHeritageObjectsAuthoredBy", input_id
+            )
+            objects_list = self._objectsFromDataFrame(df)
 
+        print(f"Objects list created: {len(objects_list)} objects")
         return objects_list
 
     def getAllActivities(self) -> List[Activity]:  # Ben/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+        all_activities = self._noResults()
 
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getAllActivities()
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            for _, row in activities_df.iterrows():
-                activity_type = row["type"]
-                activity = None  # Initialize activity variable
-
-                # Convert necessary fields to strings
-                object_id = str(row["object_id"])
-                responsible_institute = str(row["responsible_institute"])
-                responsible_person = str(row["responsible_person"])
-                tool = str(row["tool"])
-                start_date = str(row["start_date"])
-                end_date = str(row["end_date"])
-
-                # Create CulturalHeritageObject instance
-                cultural_heritage_object = CulturalHeritageObject(
-                    object_id, "", "", "", ""
-                )
-
-                if activity_type == "Acquisition":
-                    technique = str(row["technique"])
-                    activity = Acquisition(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        technique,
-                        responsible_person,
-                        start_date,
-                        end_date,
-                        tool,
-                    )
-                elif activity_type == "Processing":
-                    activity = Processing(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Modelling":
-                    activity = Modelling(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Optimising":
-                    activity = Optimising(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Exporting":
-                    activity = Exporting(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-
-                if activity:
-                    all_activities.append(activity)
-
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
-                )
+            activities_df = self._fanOut(self.processQuery, "getAllActivities")
+            all_activities = self._activitiesFromDataFrame(activities_df)
 
         return all_activities
 
     def getActivitiesByResponsibleInstitution(
-        self, institute_name: str
+        self, institute_name: str, match_mode: str = "contains"
     ) -> List[Activity]:  # Ben/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+        all_activities = self._noResults()
 
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getAllActivities()
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            if "type" not in activities_df.columns:
-                print("Warning: 'type' column not found in the DataFrame.")
-                return all_activities
-
-            for _, row in activities_df.iterrows():
-                responsible_institute = str(row["responsible_institute"])
-
-                if institute_name.lower() in responsible_institute.lower():
-                    activity_type = row["type"]
-                    object_id = str(row["object_id"])
-                    responsible_person = str(row["responsible_person"])
-                    tool = str(row["tool"])
-                    start_date = str(row["start_date"])
-                    end_date = str(row["end_date"])
-
-                    cultural_heritage_object = CulturalHeritageObject(
-                        object_id, "", "", "", ""
-                    )
-
-                    activity = None  # Initialize activity variable
-                    if activity_type == "Acquisition":
-                        technique = str(row["technique"])
-                        activity = Acquisition(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            technique,
-                            responsible_person,
-                            start_date,
-                            end_date,
-                            tool,
-                        )
-                    elif activity_type == "Processing":
-                        activity = Processing(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Modelling":
-                        activity = Modelling(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Optimising":
-                        activity = Optimising(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Exporting":
-                        activity = Exporting(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-
-                    if activity:
-                        all_activities.append(activity)
-
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
-                )
+            activities_df = self._fanOut(
+                self.processQuery, "getActivitiesByResponsibleInstitution", institute_name, match_mode
+            )
+            all_activities = self._activitiesFromDataFrame(activities_df)
 
         return all_activities
 
     def getActivitiesByResponsiblePerson(
-        self, person_name: str
+        self, person_name: str, match_mode: str = "contains"
     ) -> List[Activity]:  # Ben/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+        all_activities = self._noResults()
 
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getAllActivities()
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            if "type" not in activities_df.columns:
-                print("Warning: 'type' column not found in the DataFrame.")
-                return all_activities
-
-            for _, row in activities_df.iterrows():
-                responsible_person = str(row["responsible_person"])
-
-                if person_name.lower() in responsible_person.lower():
-                    activity_type = row["type"]
-                    object_id = str(row["object_id"])
-                    responsible_institute = str(row["responsible_institute"])
-                    tool = str(row["tool"])
-                    start_date = str(row["start_date"])
-                    end_date = str(row["end_date"])
-
-                    cultural_heritage_object = CulturalHeritageObject(
-                        object_id, "", "", "", ""
-                    )
-
-                    activity = None
-                    if activity_type == "Acquisition":
-                        technique = str(row["technique"])
-                        activity = Acquisition(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            technique,
-                            responsible_person,
-                            start_date,
-                            end_date,
-                            tool,
-                        )
-                    elif activity_type == "Processing":
-                        activity = Processing(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Modelling":
-                        activity = Modelling(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Optimising":
-                        activity = Optimising(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Exporting":
-                        activity = Exporting(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-
-                    if activity:
-                        all_activities.append(activity)
-
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
-                )
+            activities_df = self._fanOut(
+                self.processQuery, "getActivitiesByResponsiblePerson", person_name, match_mode
+            )
+            all_activities = self._activitiesFromDataFrame(activities_df)
 
         return all_activities
 
-    def getActivitiesUsingTool(self, tool_name: str) -> List[Activity]:  # Ben/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+    def getActivitiesUsingTool(
+        self, tool_name: str, match_mode: str = "exact"
+    ) -> List[Activity]:  # Ben/Ekaterina
+        all_activities = self._noResults()
 
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getAllActivities()
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            # Check if 'type' column exists
-            if "type" not in activities_df.columns:
-                print("Warning: 'type' column not found in the DataFrame.")
-                return all_activities
-
-            for _, row in activities_df.iterrows():
-                tool = str(row["tool"])
-
-                if tool_name.lower() in tool.lower():
-                    activity_type = row["type"]
-                    object_id = str(row["object_id"])
-                    responsible_person = str(row["responsible_person"])
-                    responsible_institute = str(row["responsible_institute"])
-                    start_date = str(row["start_date"])
-                    end_date = str(row["end_date"])
-
-                    cultural_heritage_object = CulturalHeritageObject(
-                        object_id, "", "", "", ""
-                    )
-
-                    activity = None
-                    if activity_type == "Acquisition":
-                        technique = str(row["technique"])
-                        activity = Acquisition(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            technique,
-                            responsible_person,
-                            start_date,
-                            end_date,
-                            tool,
-                        )
-                    elif activity_type == "Processing":
-                        activity = Processing(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Modelling":
-                        activity = Modelling(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Optimising":
-                        activity = Optimising(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-                    elif activity_type == "Exporting":
-                        activity = Exporting(
-                            cultural_heritage_object,
-                            responsible_institute,
-                            responsible_person,
-                            tool,
-                            start_date,
-                            end_date,
-                        )
-
-                    if activity:
-                        all_activities.append(activity)
-
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
-                )
+            activities_df = self._fanOut(
+                self.processQuery, "getActivitiesUsingTool", tool_name, match_mode
+            )
+            all_activities = self._activitiesFromDataFrame(activities_df)
 
         return all_activities
 
     def getActivitiesStartedAfter(
         self, date: str
     ) -> List[Activity]:  # Amanda/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+        all_activities = self._noResults()
 
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getActivitiesStartedAfter(date)
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            if "type" not in activities_df.columns:
-                print("Warning: 'type' column not found in the DataFrame.")
-                return all_activities
-
-            for index, row in activities_df.iterrows():
-                activity_type = row["type"]
-                object_id = str(row["object_id"])
-                tool = str(row["tool"])
-                responsible_person = str(row["responsible_person"])
-                responsible_institute = str(row["responsible_institute"])
-                start_date = str(row["start_date"])
-                end_date = str(row["end_date"])
-
-                cultural_heritage_object = CulturalHeritageObject(
-                    object_id, "", "", "", ""
-                )
-
-                activity = None
-                if activity_type == "Acquisition":
-                    technique = str(row["technique"])
-                    activity = Acquisition(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        technique,
-                        responsible_person,
-                        start_date,
-                        end_date,
-                        tool,
-                    )
-                elif activity_type == "Processing":
-                    activity = Processing(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Modelling":
-                    activity = Modelling(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Optimising":
-                    activity = Optimising(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Exporting":
-                    activity = Exporting(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-
-                if activity:
-                    all_activities.append(activity)
-
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
-                )
+            activities_df = self._fanOut(self.processQuery, "getActivitiesStartedAfter", date)
+            all_activities = self._activitiesFromDataFrame(activities_df)
 
         return all_activities
 
     def getActivitiesEndedBefore(self, date: str) -> List[Activity]:  # Amanda/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+        all_activities = self._noResults()
 
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getActivitiesEndedBefore(date)
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            if "type" not in activities_df.columns:
-                print("Warning: 'type' column not found in the DataFrame.")
-                return all_activities
-
-            for index, row in activities_df.iterrows():
-                activity_type = row["type"]
-                object_id = str(row["object_id"])
-                tool = str(row["tool"])
-                responsible_person = str(row["responsible_person"])
-                responsible_institute = str(row["responsible_institute"])
-                start_date = str(row["start_date"])
-                end_date = str(row["end_date"])
-
-                cultural_heritage_object = CulturalHeritageObject(
-                    object_id, "", "", "", ""
-                )
+            activities_df = self._fanOut(self.processQuery, "getActivitiesEndedBefore", date)
+            all_activities = self._activitiesFromDataFrame(activities_df)
 
-                activity = None
-                if activity_type == "Acquisition":
-                    technique = str(row["technique"])
-                    activity = Acquisition(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        technique,
-                        responsible_person,
-                        start_date,
-                        end_date,
-                        tool,
-                    )
-                elif activity_type == "Processing":
-                    activity = Processing(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Modelling":
-                    activity = Modelling(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Optimising":
-                    activity = Optimising(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
-                elif activity_type == "Exporting":
-                    activity = Exporting(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        responsible_person,
-                        tool,
-                        start_date,
-                        end_date,
-                    )
+        return all_activities
 
-                if activity:
-                    all_activities.append(activity)
+    def getAcquisitionsByTechnique(
+        self, technique: str, match_mode: str = "contains"
+    ):  # Amanda/Ekaterina
+        all_activities = self._noResults()
 
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
-                )
+        if len(self.processQuery) > 0:
+            activities_df = self._fanOut(
+                self.processQuery, "getAcquisitionsByTechnique", technique, match_mode
+            )
+            all_activities = self._activitiesFromDataFrame(
+                activities_df, ("Acquisition",)
+            )
 
         return all_activities
 
-    def getAcquisitionsByTechnique(self, technique: str):  # Amanda/Ekaterina
-        all_activities = []
-        activities_df = pd.DataFrame()
+    def _fanOut(self, handlers: list, method_name: str, *args) -> pd.DataFrame:
+        # Calls method_name with args on all the handlers at once and stacks
+        # the data frames they return without repeated rows, so that a call
+        # takes as long as the slowest handler instead of the sum of all of
+        # them. A single handler is called directly, in this thread, when
+        # there is no timeout
+        if len(handlers) == 0:
+            return pd.DataFrame()
+        if len(handlers) == 1 and self.timeout is None:
+            # with a timeout even a single handler runs in the pool, so that
+            # it can be waited for no longer than that
+            return _call_from_mashup(getattr(handlers[0], method_name), *args)
+        return self._collect(handlers, method_name, self._submit(handlers, method_name, args))
+
+    def _submit(self, handlers: list, method_name: str, args: tuple) -> list:
+        # Starts method_name on every handler in the thread pool of the mashup
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=MASHUP_WORKERS)
+        return [
+            self._executor.submit(_call_from_mashup, getattr(handler, method_name), *args)
+            for handler in handlers
+        ]
 
-        if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getAcquisitionsByTechnique(technique)
-            print("DataFrame returned from SQL query:")
-            print(activities_df)
-
-            if "type" not in activities_df.columns:
-                print("Warning: 'type' column not found in the DataFrame.")
-                return all_activities
-
-            for index, row in activities_df.iterrows():
-                activity_type = row["type"]
-                object_id = str(row["object_id"])
-                tool = str(row["tool"])
-                responsible_person = str(row["responsible_person"])
-                responsible_institute = str(row["responsible_institute"])
-                start_date = str(row["start_date"])
-                end_date = str(row["end_date"])
-
-                cultural_heritage_object = CulturalHeritageObject(
-                    object_id, "", "", "", ""
+    def _collect(self, handlers: list, method_name: str, futures: list) -> pd.DataFrame:
+        # Results of the futures of _submit. A handler that fails or does not
+        # answer within self.timeout is left out, unless none of them
+        # answered: then the error of the first one is raised, so that a
+        # failure does not look like an empty result
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        frames = []
+        errors = []
+        for handler, future in zip(handlers, futures):
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            try:
+                frames.append(future.result(remaining))
+            except FutureTimeoutError:
+                # the handler keeps its thread until it is done
+                print(
+                    f"{method_name} on {handler.getDbPathOrUrl()} "
+                    f"timed out after {self.timeout} seconds"
                 )
+                errors.append(FutureTimeoutError(
+                    f"{method_name} on {handler.getDbPathOrUrl()} timed out"
+                ))
+            except _HANDLER_ERRORS as e:
+                print(f"{method_name} on {handler.getDbPathOrUrl()} failed: {e}")
+                errors.append(e)
+
+        if len(frames) == 0 and errors:
+            raise errors[0]
+        return self._mergeFrames(frames)
+
+    def _mergeFrames(self, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        # The results of several handlers in one data frame without
+        # repeated rows
+        if len(frames) == 0:
+            return pd.DataFrame()
+        if len(frames) == 1:
+            return frames[0]
+        return concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+
+    def _fanOutAll(self, *calls) -> List[pd.DataFrame]:
+        # Runs independent _fanOut calls, given as (handlers, method_name,
+        # *args), at the same time and returns their data frames in order;
+        # all their handler calls go to the pool before any is waited for
+        if sum(len(handlers) for handlers, *_ in calls) <= 1 and self.timeout is None:
+            return [self._fanOut(*call) for call in calls]
+        started = [
+            (handlers, method_name, self._submit(handlers, method_name, args))
+            for handlers, method_name, *args in calls
+        ]
+        return [
+            self._collect(handlers, method_name, futures)
+            if handlers else pd.DataFrame()
+            for handlers, method_name, futures in started
+        ]
 
-                activity = None
-                if activity_type == "Acquisition":
-                    technique = str(row["technique"])
-                    activity = Acquisition(
-                        cultural_heritage_object,
-                        responsible_institute,
-                        technique,
-                        responsible_person,
-                        start_date,
-                        end_date,
-                        tool,
-                    )
+    def close(self) -> None:
+        # Stops the thread pool of the mashup, a later call starts a new one
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _noResults(self) -> List:
+        # Empty result of a method returning objects or activities, a
+        # LazyResult like the other results when the mashup is lazy
+        if self.lazy:
+            return LazyResult(pd.DataFrame(), lambda rows: [])
+        return []
+
+    def _column(self, df: pd.DataFrame, column: str) -> list:
+        # Values of a column as a plain list, None for every row when the
+        # query did not select it
+        if column in df.columns:
+            return df[column].tolist()
+        return [None] * len(df)
+
+    def _uniquePeople(self, df: pd.DataFrame, id_column: str = "id") -> List[Person]:
+        # The people of df once each, in the order they first appear
+        people = {}
+        for person in self._peopleFromDataFrame(df, id_column):
+            people.setdefault(person.id, person)
+        return list(people.values())
+
+    def _peopleFromDataFrame(
+        self, df: pd.DataFrame, id_column: str = "id", name_column: str = "name"
+    ) -> List[Person]:
+        identity_map = IdentityMap()
+        return [
+            identity_map.getPerson(person_id, name)
+            for person_id, name in zip(
+                self._column(df, id_column), self._column(df, name_column)
+            )
+        ]
 
-                if activity:
-                    all_activities.append(activity)
+    def _objectsFromDataFrame(self, df: pd.DataFrame) -> List[CulturalHeritageObject]:
+        # the pages of a lazy result share the identity map of the call
+        identity_map = IdentityMap()
+        if not self.lazy:
+            return self._buildObjects(df, identity_map)
+
+        def build(rows):
+            return self._buildObjects(rows, identity_map)
+
+        if "type_name" not in df.columns or "id" not in df.columns:
+            return LazyResult(df.iloc[0:0], build)
+        df = df[df["type_name"].isin(list(OBJECT_CLASSES))]
+        # the rows of every object next to each other, objects in the
+        # order they first appear
+        codes, uniques = pd.factorize(df["id"].astype(str))
+        df = df.iloc[np.argsort(codes, kind="stable")]
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(uniques)))))
+        return LazyResult(df, build, offsets)
+
+    def _buildObjects(
+        self, df: pd.DataFrame, identity_map: Optional[IdentityMap] = None
+    ) -> List[CulturalHeritageObject]:
+        # One object per id, the class is looked up in OBJECT_CLASSES by
+        # the type_name column and the rows of an object with several
+        # authors add up to the same instance
+        if identity_map is None:
+            identity_map = IdentityMap()
+        objects = {}  # id -> class, title, date, owner, place, authors
+        has_author = [False] * len(df)
+        if "author_id" in df.columns and "author_name" in df.columns:
+            has_author = (df["author_id"].notna() & df["author_name"].notna()).tolist()
+
+        for type_name, id, title, date, owner, place, author_id, author_name, authored in zip(
+            self._column(df, "type_name"),
+            self._column(df, "id"),
+            self._column(df, "title"),
+            self._column(df, "date"),
+            self._column(df, "owner"),
+            self._column(df, "place"),
+            self._column(df, "author_id"),
+            self._column(df, "author_name"),
+            has_author,
+        ):
+            cls = OBJECT_CLASSES.get(type_name)
+            if cls is None:
+                print(f"No class defined for type: {type_name}")
+                continue
+
+            fields = objects.get(str(id))
+            if fields is None:
+                fields = objects[str(id)] = (cls, title, date, str(owner), place, [])
+            if authored:
+                author = identity_map.getPerson(str(author_id), author_name)
+                if author not in fields[5]:
+                    fields[5].append(author)
+
+        return [
+            identity_map.getObject(cls, id, title, date, owner, place, authors)
+            for id, (cls, title, date, owner, place, authors) in objects.items()
+        ]
 
-            print("Activities list created:")
-            for activity in all_activities:
-                print(
-                    f"Activity Type: {type(activity).__name__}, "
-                    f"Responsible Institute: {activity.institute}, "
-                    f"Responsible Person: {activity.person}, "
-                    f"Tool: {activity.tool}, "
-                    f"Start Date: {activity.start}, "
-                    f"End Date: {activity.end}"
+    def _activitiesFromDataFrame(
+        self,
+        df: pd.DataFrame,
+        activity_types=ACTIVITY_TYPES,
+        objects_df: Optional[pd.DataFrame] = None,
+    ) -> List[Activity]:
+        # objects_df are metadata rows already fetched by the call, the
+        # activities on those objects refer to the objects built from them
+        if "type" not in df.columns:
+            print("Warning: 'type' column not found in the DataFrame.")
+            return self._noResults()
+
+        # the pages of a lazy result share the identity map of the call
+        identity_map = IdentityMap()
+        if objects_df is not None:
+            self._buildObjects(objects_df, identity_map)
+        if self.lazy:
+            def build(rows):
+                return self._buildActivities(rows, activity_types, identity_map)
+
+            return LazyResult(df[df["type"].isin(list(activity_types))], build)
+        activities = self._buildActivities(df, activity_types, identity_map)
+        print(f"Activities list created: {len(activities)} activities")
+        return activities
+
+    def _buildActivities(
+        self,
+        df: pd.DataFrame,
+        activity_types=ACTIVITY_TYPES,
+        identity_map: Optional[IdentityMap] = None,
+    ) -> List[Activity]:
+        # One activity per row, the class is looked up in ACTIVITY_CLASSES by
+        # the type column; every value is turned into a string as before
+        if identity_map is None:
+            identity_map = IdentityMap()
+        activities = []
+        for activity_type, object_id, institute, person, technique, tool, start, end in zip(
+            self._column(df, "type"),
+            map(str, self._column(df, "object_id")),
+            map(str, self._column(df, "responsible_institute")),
+            map(str, self._column(df, "responsible_person")),
+            map(str, self._column(df, "technique")),
+            map(str, self._column(df, "tool")),
+            map(str, self._column(df, "start_date")),
+            map(str, self._column(df, "end_date")),
+        ):
+            if activity_type not in activity_types:
+                continue
+            cls = ACTIVITY_CLASSES[activity_type]
+            refers_to = identity_map.getObjectStub(object_id)
+
+            if cls is Acquisition:
+                activities.append(
+                    cls(refers_to, institute, technique, person, start, end, tool)
                 )
+            else:
+                activities.append(cls(refers_to, institute, person, tool, start, end))
 
-        return all_activities
+        return activities
 
 
 class AdvancedMashup(BasicMashup):
-    def __init__(self, metadataQuery=None, processQuery=None):
-        super().__init__(metadataQuery, processQuery)
+    def __init__(self, metadataQuery=None, processQuery=None, lazy=False, timeout=None):
+        super().__init__(metadataQuery, processQuery, lazy, timeout)
         
     def getActivitiesOnObjectsAuthoredBy(
         self, author_id: str
     ) -> list[Activity]:  # Rubens
-        related_cultural_heritage_objects = self.metadataQuery[
-            0
-        ].getCulturalHeritageObjectsAuthoredBy(author_id)
-
-        related_ids = set(related_cultural_heritage_objects["id"])
-        print("Related IDs:", related_ids)
-        related_ids_str = {str(id) for id in related_ids}
+        related_cultural_heritage_objects = self._fanOut(
+            self.metadataQuery, "getCulturalHeritageObjectsAuthoredBy", author_id
+        )
+        if "id" not in related_cultural_heritage_objects.columns:
+            return self._noResults()
 
-        all_activities = self.processQuery[0].getAllActivities()
-        # print(all_activities)
+        related_ids = set(related_cultural_heritage_objects["id"].astype(str))
+        print(f"Related IDs: {len(related_ids)} objects")
 
-        # Convert object_id column to string (if not already)
+        # only the activities on the related objects are fetched
+        selected_rows = self._fanOut(self.processQuery, "getActivitiesOnObjects", related_ids)
 
-        all_activities["object_id"] = all_activities["object_id"].astype(str)
-        selected_rows = all_activities[
-            all_activities["object_id"].isin(related_ids_str)
-        ]
-        
-        # Convert selected_rows to a list of Activity objects
-        activities_list = [Activity(row) for index, row in selected_rows.iterrows()]
-        
-        return activities_list
+        return self._activitiesFromDataFrame(
+            selected_rows, objects_df=related_cultural_heritage_objects
+        )
 
     def getObjectsHandledByResponsiblePerson(
         self, responsible_person: str
     ) -> List[CulturalHeritageObject]:  # Ekaterina
-        all_objects = []
+        all_objects = self._noResults()
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getActivitiesByResponsiblePerson(
-                responsible_person
-            )
+            activities_df = self._fanOut(self.processQuery, "getActivitiesByResponsiblePerson", responsible_person)
 
-            if len(self.metadataQuery) > 0:
-                objects_df = self.metadataQuery[0].getAllCulturalHeritageObjects()
-
-                object_ids = []
-                for index, row in activities_df.iterrows():
-                    activity_id = row["object_id"]
-                    if activity_id not in object_ids:
-                        object_ids.append(activity_id)
-                        object_data = objects_df[objects_df["id"] == activity_id].iloc[
-                            0
-                        ]
-                        object_type = object_data["type_name"]
-                        if object_type == "NauticalChart":
-                            obj = NauticalChart(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "ManuscriptPlate":
-                            obj = ManuscriptPlate(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "ManuscriptVolume":
-                            obj = ManuscriptVolume(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "PrintedVolume":
-                            obj = PrintedVolume(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "PrintedMaterial":
-                            obj = PrintedMaterial(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Herbarium":
-                            obj = Herbarium(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Specimen":
-                            obj = Specimen(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Painting":
-                            obj = Painting(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Model":
-                            obj = Model(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=str(object_data["author_id"]),
-                                author_name=object_data["author_name"],
-                            )
-                        elif object_type == "Model":
-                            obj = Model(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Map":
-                            obj = Map(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        else:
-                            print(f"No class defined for type: {object_type}")
-                            continue
-
-                    all_objects.append(obj)
-
-        print("Cultural Heritage Objects list created:")
-        for obj in all_objects:
-            print(
-                f"Object ID: {obj.id}, Title: {obj.title}, Type: {type(obj).__name__}"
-            )
+            if len(self.metadataQuery) > 0 and "object_id" in activities_df.columns:
+                # only the objects the activities refer to are fetched
+                object_ids = set(activities_df["object_id"].astype(str))
+                objects_df = self._fanOut(
+                    self.metadataQuery, "getCulturalHeritageObjectsByIds", object_ids
+                )
+                all_objects = self._objectsHandledBy(activities_df, objects_df)
 
+        print(f"Cultural Heritage Objects list created: {len(all_objects)} objects")
         return all_objects
 
     def getObjectsHandledByResponsibleInstitution(
         self, institute_name: str
     ) -> List[CulturalHeritageObject]:  # Ekaterina
-        all_objects = []
-        activities_df = pd.DataFrame()
-
+        all_objects = self._noResults()
         if len(self.processQuery) > 0:
-            activities_df = self.processQuery[0].getActivitiesByResponsibleInstitution(
-                institute_name
-            )
+            activities_df = self._fanOut(self.processQuery, "getActivitiesByResponsibleInstitution", institute_name)
 
-            if len(self.metadataQuery) > 0:
-                objects_df = self.metadataQuery[0].getAllCulturalHeritageObjects()
-
-                object_ids = []
-                for _, row in activities_df.iterrows():
-                    activity_id = row["object_id"]
-                    if activity_id not in object_ids:
-                        object_ids.append(activity_id)
-                        object_data = objects_df[objects_df["id"] == activity_id].iloc[
-                            0
-                        ]
-                        object_type = object_data["type_name"]
-                        if object_type == "NauticalChart":
-                            obj = NauticalChart(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "ManuscriptPlate":
-                            obj = ManuscriptPlate(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "ManuscriptVolume":
-                            obj = ManuscriptVolume(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "PrintedVolume":
-                            obj = PrintedVolume(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "PrintedMaterial":
-                            obj = PrintedMaterial(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Herbarium":
-                            obj = Herbarium(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Specimen":
-                            obj = Specimen(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Painting":
-                            obj = Painting(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Model":
-                            obj = Model(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=str(object_data["author_id"]),
-                                author_name=object_data["author_name"],
-                            )
-                        elif object_type == "Model":
-                            obj = Model(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        elif object_type == "Map":
-                            obj = Map(
-                                id=str(object_data["id"]),
-                                title=object_data["title"],
-                                date=str(object_data["date"]),
-                                owner=str(object_data["owner"]),
-                                place=object_data["place"],
-                                author_id=(
-                                    str(object_data["author_id"])
-                                    if "author_id" in objects_df.columns
-                                    else None
-                                ),
-                                author_name=(
-                                    object_data["author_name"]
-                                    if "author_name" in objects_df.columns
-                                    else None
-                                ),
-                            )
-                        else:
-                            print(f"No class defined for type: {object_type}")
-                            continue
-
-                        all_objects.append(obj)
-
-        print("Cultural Heritage Objects list created:")
-        for obj in all_objects:
-            print(
-                f"Object ID: {obj.id}, Title: {obj.title}, Type: {type(obj).__name__}"
-            )
+            if len(self.metadataQuery) > 0 and "object_id" in activities_df.columns:
+                # only the objects the activities refer to are fetched
+                object_ids = set(activities_df["object_id"].astype(str))
+                objects_df = self._fanOut(
+                    self.metadataQuery, "getCulturalHeritageObjectsByIds", object_ids
+                )
+                all_objects = self._objectsHandledBy(activities_df, objects_df)
 
+        print(f"Cultural Heritage Objects list created: {len(all_objects)} objects")
         return all_objects
 
+    def _objectsHandledBy(
+        self, activities_df: pd.DataFrame, objects_df: pd.DataFrame
+    ) -> List[CulturalHeritageObject]:
+        # Hash join of the metadata rows on the object ids of the activities,
+        # objects in the order the activities first mention them
+        if "object_id" not in activities_df.columns or "id" not in objects_df.columns:
+            return self._noResults()
+        object_ids = activities_df["object_id"].astype(str).drop_duplicates()
+        position = pd.Series(np.arange(len(object_ids)), index=object_ids.values)
+        order = objects_df["id"].astype(str).map(position)
+        objects_df = objects_df[order.notna()]
+        order = order.dropna().to_numpy()
+        return self._objectsFromDataFrame(
+            objects_df.iloc[np.argsort(order, kind="stable")]
+        )
+
     def getAuthorsOfObjectsAcquiredInTimeFrame(
         self, start_date: str, end_date: str
     ) -> list[Person]:  # Rubens
         acquired_authors = []
 
-        activities_started = self.processQuery[0].getActivitiesStartedAfter(start_date)
+        # the two searches do not depend on each other
+        activities_started, activities_ended = self._fanOutAll(
+            (self.processQuery, "getActivitiesStartedAfter", start_date),
+            (self.processQuery, "getActivitiesEndedBefore", end_date),
+        )
+        common_ids = self._acquiredInTimeFrame(activities_started, activities_ended)
+        print(f"IDs of this timeframe: {len(common_ids)} objects")
+
+        # one batched lookup per handler instead of one query per object
+        if common_ids:
+            authors_df = self._fanOut(
+                self.metadataQuery, "getAuthorsOfCulturalHeritageObjects", sorted(common_ids)
+            )
+            # the same author can be found by several handlers
+            acquired_authors = self._uniquePeople(authors_df)
+
+        return acquired_authors
+
+    def _acquiredInTimeFrame(
+        self, activities_started: pd.DataFrame, activities_ended: pd.DataFrame
+    ) -> set:
+        # Ids of the objects acquired after the start date and exported
+        # before the end date
+        if "type" not in activities_started.columns or "type" not in activities_ended.columns:
+            return set()
+
         started_ids = set(
             activities_started[activities_started["type"] == "Acquisition"]["object_id"]
         )
 
-        activities_ended = self.processQuery[0].getActivitiesEndedBefore(end_date)
         ended_ids = set(
             activities_ended[activities_ended["type"] == "Exporting"]["object_id"]
         )
 
-        common_ids = started_ids.intersection(ended_ids)
-        common_ids_int = {int(id) for id in common_ids}
-        print("IDs of this timeframe:", common_ids_int)
+        return started_ids.intersection(ended_ids)
 
-        for item in common_ids_int:
-            authors = self.getAuthorsOfCulturalHeritageObject(item)
-            acquired_authors.extend(authors)
 
-        return acquired_authors
-    
+class AsyncAdvancedMashup(AdvancedMashup):
+    # AdvancedMashup for event loops: every a-method is the async
+    # counterpart of the method of the same name, the handlers are queried
+    # with their own async methods at once through asyncio.gather
+
+    async def agetEntityById(self, id: str) -> IdentifiableEntity | None:
+        people_df = await self._afanOut(self.metadataQuery, "getById", id)
+        return self._uniquePeople(people_df, "identifier") or None
+
+    async def agetAllPeople(self) -> List[Person]:
+        return self._uniquePeople(await self._afanOut(self.metadataQuery, "getAllPeople"))
+
+    async def agetAllCulturalHeritageObjects(self) -> List[CulturalHeritageObject]:
+        return await self._aobjects("getAllCulturalHeritageObjects")
+
+    async def agetAuthorsOfCulturalHeritageObject(self, object_id: str) -> List[Person]:
+        authors_df = await self._afanOut(
+            self.metadataQuery, "getAuthorsOfCulturalHeritageObject", object_id
+        )
+        return self._uniquePeople(authors_df)
+
+    async def agetCulturalHeritageObjectsAuthoredBy(
+        self, input_id: str
+    ) -> List[CulturalHeritageObject]:
+        return await self._aobjects("getCulturalHeritageObjectsAuthoredBy", input_id)
+
+    async def agetAllActivities(self) -> List[Activity]:
+        return await self._aactivities("getAllActivities")
+
+    async def agetActivitiesByResponsibleInstitution(
+        self, institute_name: str, match_mode: str = "contains"
+    ) -> List[Activity]:
+        return await self._aactivities(
+            "getActivitiesByResponsibleInstitution", institute_name, match_mode
+        )
+
+    async def agetActivitiesByResponsiblePerson(
+        self, person_name: str, match_mode: str = "contains"
+    ) -> List[Activity]:
+        return await self._aactivities(
+            "getActivitiesByResponsiblePerson", person_name, match_mode
+        )
+
+    async def agetActivitiesUsingTool(
+        self, tool_name: str, match_mode: str = "exact"
+    ) -> List[Activity]:
+        return await self._aactivities("getActivitiesUsingTool", tool_name, match_mode)
+
+    async def agetActivitiesStartedAfter(self, date: str) -> List[Activity]:
+        return await self._aactivities("getActivitiesStartedAfter", date)
+
+    async def agetActivitiesEndedBefore(self, date: str) -> List[Activity]:
+        return await self._aactivities("getActivitiesEndedBefore", date)
+
+    async def agetAcquisitionsByTechnique(
+        self, technique: str, match_mode: str = "contains"
+    ) -> List[Activity]:
+        return await self._aactivities(
+            "getAcquisitionsByTechnique", technique, match_mode,
+            activity_types=("Acquisition",),
+        )
+
+    async def agetActivitiesOnObjectsAuthoredBy(self, author_id: str) -> List[Activity]:
+        objects_df = await self._afanOut(
+            self.metadataQuery, "getCulturalHeritageObjectsAuthoredBy", author_id
+        )
+        if "id" not in objects_df.columns:
+            return self._noResults()
+        related_ids = set(objects_df["id"].astype(str))
+        return await self._aactivities(
+            "getActivitiesOnObjects", related_ids, objects_df=objects_df
+        )
+
+    async def agetObjectsHandledByResponsiblePerson(
+        self, responsible_person: str
+    ) -> List[CulturalHeritageObject]:
+        return await self._aobjectsHandledBy(
+            "getActivitiesByResponsiblePerson", responsible_person
+        )
+
+    async def agetObjectsHandledByResponsibleInstitution(
+        self, institute_name: str
+    ) -> List[CulturalHeritageObject]:
+        return await self._aobjectsHandledBy(
+            "getActivitiesByResponsibleInstitution", institute_name
+        )
+
+    async def agetAuthorsOfObjectsAcquiredInTimeFrame(
+        self, start_date: str, end_date: str
+    ) -> List[Person]:
+        activities_started, activities_ended = await asyncio.gather(
+            self._afanOut(self.processQuery, "getActivitiesStartedAfter", start_date),
+            self._afanOut(self.processQuery, "getActivitiesEndedBefore", end_date),
+        )
+        common_ids = self._acquiredInTimeFrame(activities_started, activities_ended)
+        if not common_ids:
+            return []
+        authors_df = await self._afanOut(
+            self.metadataQuery, "getAuthorsOfCulturalHeritageObjects", sorted(common_ids)
+        )
+        return self._uniquePeople(authors_df)
+
+    async def _afanOut(self, handlers: list, method_name: str, *args) -> pd.DataFrame:
+        # Same as _fanOut and _collect with the async counterpart of
+        # method_name: failed handlers are left out unless none answered
+        async def call(handler):
+            # every call runs in a task of its own, with its own context
+            _mashup_call.set(True)
+            try:
+                return await asyncio.wait_for(
+                    getattr(handler, "a" + method_name)(*args), self.timeout
+                )
+            except asyncio.TimeoutError:
+                print(
+                    f"{method_name} on {handler.getDbPathOrUrl()} "
+                    f"timed out after {self.timeout} seconds"
+                )
+                return asyncio.TimeoutError(
+                    f"{method_name} on {handler.getDbPathOrUrl()} timed out"
+                )
+            except _HANDLER_ERRORS as e:
+                print(f"{method_name} on {handler.getDbPathOrUrl()} failed: {e}")
+                return e
+
+        results = await asyncio.gather(*(call(handler) for handler in handlers))
+        frames = [result for result in results if isinstance(result, pd.DataFrame)]
+        if len(frames) == 0 and results:
+            raise results[0]
+        return self._mergeFrames(frames)
+
+    async def _aactivities(
+        self, method_name: str, *args, activity_types=ACTIVITY_TYPES, objects_df=None
+    ) -> List[Activity]:
+        if len(self.processQuery) == 0:
+            return self._noResults()
+        activities_df = await self._afanOut(self.processQuery, method_name, *args)
+        return self._activitiesFromDataFrame(activities_df, activity_types, objects_df)
+
+    async def _aobjects(self, method_name: str, *args) -> List[CulturalHeritageObject]:
+        if len(self.metadataQuery) == 0:
+            return self._noResults()
+        objects_df = await self._afanOut(self.metadataQuery, method_name, *args)
+        return self._objectsFromDataFrame(objects_df)
+
+    async def _aobjectsHandledBy(
+        self, method_name: str, *args
+    ) -> List[CulturalHeritageObject]:
+        # the activities first, then only the objects they refer to
+        activities_df = await self._afanOut(self.processQuery, method_name, *args)
+        if len(self.metadataQuery) == 0 or "object_id" not in activities_df.columns:
+            return self._noResults()
+        objects_df = await self._afanOut(
+            self.metadataQuery,
+            "getCulturalHeritageObjectsByIds",
+            set(activities_df["object_id"].astype(str)),
+        )
+        return self._objectsHandledBy(activities_df, objects_df)
+
 
 
 # -*- coding: utf-8 -*-
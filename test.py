@@ -12,13 +12,34 @@
 # DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
 # ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
 # SOFTWARE.
+import asyncio
+import gc
+import http.server
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 from os import sep
-from pandas import DataFrame
+from urllib.parse import parse_qs
+import requests
+from pandas import DataFrame, isna
+from pandas.errors import DatabaseError
 from impl import MetadataUploadHandler, ProcessDataUploadHandler
 from impl import MetadataQueryHandler, ProcessDataQueryHandler
-from impl import AdvancedMashup
+from impl import BasicMashup, AdvancedMashup, AsyncAdvancedMashup
 from impl import Person, CulturalHeritageObject, Activity, Acquisition
+from impl import ACTIVITY_TYPES, MASHUP_WORKERS, LazyResult, ResultCache, _iter_json_array
+from impl import _sparql_tsv_frame
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 # REMEMBER: before launching the tests, please run the Blazegraph instance!
 # 
@@ -170,6 +191,884 @@ class TestProjectBasic(unittest.TestCase):
         for i in r:
             self.assertIsInstance(i, Person)
 
+class StubEndpoint(object):
+    # Local HTTP server standing in for Blazegraph: every POST is kept in
+    # requests as (headers, body) and answered by answer(headers, body),
+    # which returns the status, the content type and the body to send
+    def __init__(self, answer):
+        self.requests = []
+        stub = self
+
+        class Endpoint(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests.append((self.headers, body))
+                status, content_type, response = answer(self.headers, body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Endpoint)
+        self.url = "http://127.0.0.1:%d/blazegraph/sparql" % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def csv_answer(body: bytes):
+    # answer of a StubEndpoint always sending body as SPARQL CSV results
+    return lambda headers, request: (200, "text/csv", body)
+
+
+class TestRelationalDatabase(unittest.TestCase):
+
+    # These tests use SQLite and a local StubEndpoint, so they do not need the
+    # Blazegraph instance
+    process = "Data" + sep + "process (2).json"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.relational = self.tmp.name + sep + "relational.db"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, path: str = None, **options) -> ProcessDataUploadHandler:
+        # Loads the process data into path, self.relational by default
+        u = ProcessDataUploadHandler(**options)
+        u.setDbPathOrUrl(path or self.relational)
+        self.assertTrue(u.pushDataToDb(self.process))
+        return u
+
+    def open(self, path: str = None, handler=ProcessDataQueryHandler, **options):
+        # Query handler on path, closed at the end of the test
+        q = handler(**options)
+        q.setDbPathOrUrl(path or self.relational)
+        self.addCleanup(q.close)
+        return q
+
+    def test_01_iter_json_array(self):
+        with open(self.process) as f:
+            expected = json.load(f)
+        for read_size in (1, 7, 1 << 16):
+            with open(self.process) as f:
+                self.assertEqual(list(_iter_json_array(f, read_size)), expected)
+
+        # an error in the data is raised where it is, without reading the
+        # rest of the file into the buffer
+        text = '[{"a": 1}, {"a": 2,, "b": 3}, ' + '{"a": 4}, ' * 10000 + "{}]"
+        f = io.StringIO(text)
+        with self.assertRaises(json.JSONDecodeError):
+            list(_iter_json_array(f, 16))
+        self.assertLess(f.tell(), 100)
+
+    @unittest.skipUnless(ijson, "ijson is not installed")
+    def test_02_ijson_numbers(self):
+        # ijson gives Decimal numbers by default, which SQLite cannot store
+        with open(self.process) as f:
+            item = json.load(f)[0]
+        item["object id"] = 1.5
+        path = self.tmp.name + sep + "numbers.json"
+        with open(path, "w") as f:
+            json.dump([item], f)
+        u = ProcessDataUploadHandler(stream=True)
+        u.setDbPathOrUrl(self.relational)
+        self.assertTrue(u.pushDataToDb(path))
+        with sqlite3.connect(self.relational) as conn:
+            rows = conn.execute('SELECT object_id FROM Acquisition').fetchall()
+        self.assertEqual([float(value) for (value,) in rows], [1.5])
+
+    def test_03_streaming_upload(self):
+        tables = {}
+        for stream in (True, False):
+            u = ProcessDataUploadHandler(stream=stream, chunk_size=7)
+            path = self.relational + str(stream)
+            self.assertTrue(u.setDbPathOrUrl(path))
+            self.assertTrue(u.pushDataToDb(self.process))
+            with sqlite3.connect(path) as conn:
+                tables[stream] = {
+                    t: conn.execute(f"SELECT * FROM {t}").fetchall()
+                    for t in ACTIVITY_TYPES
+                }
+        self.assertEqual(tables[True], tables[False])
+        self.assertEqual(len(tables[True]["Acquisition"]), 35)
+
+        # the load runs in WAL mode, then the database gets its own mode back
+        with sqlite3.connect(self.relational + "wal") as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        for path, mode in ((self.relational, "delete"), (self.relational + "wal", "wal")):
+            self.load(path)
+            conn = sqlite3.connect(path)
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], mode)
+            conn.close()
+        self.assertFalse(os.path.exists(self.relational + "-wal"))
+
+    def test_04_query_plan_uses_indexes(self):
+        self.load()
+        q = self.open()
+        for method, arg in (
+            ("getActivitiesStartedAfter", "2023-06-01"),
+            ("getActivitiesEndedBefore", "2023-06-01"),
+        ):
+            plan = q.getQueryPlan(method, arg)
+            scans = [d for d in plan["detail"] if d.startswith(("SCAN", "SEARCH"))]
+            self.assertEqual(len(scans), len(ACTIVITY_TYPES))
+            for detail in scans:
+                self.assertIn("USING INDEX", detail)
+        self.assertEqual(len(q.getActivitiesStartedAfter("2023-06-01")), 85)
+
+    def test_05_tool_lookup(self):
+        self.load()
+
+        with open(self.process) as f:
+            tools = [
+                item[activity]["tool"]
+                for item in json.load(f)
+                for activity in ("acquisition", "processing", "modelling", "optimising", "exporting")
+            ]
+
+        q = self.open()
+        exact = q.getActivitiesUsingTool("instant meshes")
+        self.assertEqual(len(exact), sum("Instant Meshes" in t for t in tools))
+        self.assertTrue(q.getActivitiesUsingTool("instant meshes", case_sensitive=True).empty)
+        prefix = q.getActivitiesUsingTool("Instant Meshes", "prefix", True)
+        self.assertEqual(
+            len(prefix), sum(any(n.startswith("Instant Meshes") for n in t) for t in tools)
+        )
+        self.assertGreater(len(prefix), len(exact))
+
+    def test_06_match_modes(self):
+        self.load(fulltext=True)
+        q = self.open()
+        contains = q.getActivitiesByResponsiblePerson("Hopper")
+        self.assertFalse(contains.empty)
+        self.assertTrue(q.getActivitiesByResponsiblePerson("Hopper", "exact").empty)
+        self.assertTrue(q.getActivitiesByResponsiblePerson("Hopper", "prefix").empty)
+        self.assertEqual(
+            len(q.getActivitiesByResponsiblePerson("grace hopper", "exact")), len(contains)
+        )
+        self.assertEqual(
+            len(q.getActivitiesByResponsiblePerson("Grace", "prefix")), len(contains)
+        )
+        self.assertEqual(
+            len(q.getActivitiesByResponsiblePerson("Hopper", "fulltext")), len(contains)
+        )
+        plan = q.getQueryPlan("getActivitiesByResponsiblePerson", "Hopper", "fulltext")
+        self.assertTrue(any("activity_fts" in d for d in plan["detail"]))
+        for blank in ("", "  "):
+            self.assertEqual(
+                len(q.getActivitiesByResponsiblePerson(blank, "fulltext")),
+                len(q.getActivitiesByResponsiblePerson(blank)),
+            )
+
+        # the index stays in sync with later loads, and one created on a
+        # database that has activities already covers them too
+        for first, second in ((True, False), (False, True)):
+            path = self.relational + str(first)
+            self.load(path, fulltext=first)
+            self.load(path, fulltext=second)
+            q = self.open(path)
+            for person in ("Hopper", "Grace"):
+                self.assertEqual(
+                    len(q.getActivitiesByResponsiblePerson(person, "fulltext")),
+                    len(q.getActivitiesByResponsiblePerson(person)),
+                )
+            self.assertEqual(
+                len(q.getActivitiesByResponsiblePerson("Hopper", "fulltext")), 2 * len(contains)
+            )
+
+    def test_07_persistent_connection(self):
+        q = self.open()
+        # missing database: no results, and nothing is created by a read-only handler
+        self.assertTrue(q.getAllActivities().empty)
+
+        self.load()
+        self.assertEqual(len(q.getAllActivities()), 35 * len(ACTIVITY_TYPES))
+
+        conn = q._connection()
+        q.getActivitiesEndedBefore("2029-01-01")
+        self.assertIs(q._connection(), conn)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM Acquisition")
+
+        q.setDbPathOrUrl(self.relational)
+        self.assertIsNot(q._connection(), conn)
+
+        # the connections of threads that are gone are closed with them
+        for _ in range(20):
+            thread = threading.Thread(target=q.getActivitiesStartedAfter, args=("2023",))
+            thread.start()
+            thread.join()
+        gc.collect()
+        self.assertEqual(len(q._connections), 1)
+        q.close()
+
+    def test_08_unified_layout(self):
+        results = {}
+        for layout in ("tables", "unified"):
+            self.load(self.relational + layout, layout=layout)
+            q = self.open(self.relational + layout)
+            results[layout] = [
+                sorted(df.astype(object).fillna("").values.tolist())
+                for df in (
+                    q.getAllActivities(),
+                    q.getActivitiesByResponsibleInstitution("council"),
+                    q.getActivitiesUsingTool("Blender"),
+                    q.getActivitiesEndedBefore("2023-06-01"),
+                    q.getAcquisitionsByTechnique("photo", "prefix"),
+                )
+            ]
+            if layout == "unified":
+                plan = q.getQueryPlan("getActivitiesStartedAfter", "2023-06-01")
+                self.assertEqual(
+                    plan["detail"].tolist(),
+                    ["SEARCH activity USING INDEX idx_activity_dates (start_date>?)"],
+                )
+                # the compatibility views have the columns of the old tables
+                rows = q._connection().execute("SELECT * FROM Acquisition").fetchall()
+                self.assertEqual(len(rows), 35)
+        self.assertEqual(results["tables"], results["unified"])
+
+        # a database keeps the layout of its first load
+        for layout, other in (("tables", "unified"), ("unified", "tables")):
+            u = ProcessDataUploadHandler(layout=other)
+            u.setDbPathOrUrl(self.relational + layout)
+            self.assertFalse(u.pushDataToDb(self.process))
+            q = self.open(self.relational + layout)
+            self.assertEqual(len(q.getAllActivities()), 175)
+
+    def test_09_mashup_filters_in_sql(self):
+        self.load()
+        q = self.open()
+        m = BasicMashup([], [])
+        m.addProcessHandler(q)
+
+        all_activities = m.getAllActivities()
+        for method, value, attribute in (
+            (m.getActivitiesByResponsibleInstitution, "council", "institute"),
+            (m.getActivitiesByResponsiblePerson, "doe", "person"),
+            (m.getActivitiesUsingTool, "blender", "tool"),
+        ):
+            expected = [
+                a for a in all_activities
+                if value in str(getattr(a, attribute)).lower()
+            ]
+            result = method(value, "contains")
+            self.assertGreater(len(result), 0)
+            self.assertEqual(len(result), len(expected))
+
+        # the mashup uses the match modes of the handler by default
+        self.assertEqual(
+            len(m.getActivitiesUsingTool("blender")), len(q.getActivitiesUsingTool("blender"))
+        )
+        self.assertEqual(
+            len(m.getAcquisitionsByTechnique("photo", "prefix")),
+            len(q.getAcquisitionsByTechnique("photo", "prefix")),
+        )
+        self.assertEqual(len(m.getAcquisitionsByTechnique("scanner")), 3)
+        self.assertEqual(len(m.getAcquisitionsByTechnique("scanner", "prefix")), 0)
+
+    def test_10_materialization(self):
+        m = AdvancedMashup()
+        objects = m._objectsFromDataFrame(DataFrame({
+            "type_name": ["Map", "Painting", "Statue"],
+            "id": [1, 2, 3],
+            "title": ["A", "B", "C"],
+            "date": ["1700", "1800", "1900"],
+            "owner": ["O", "O", "O"],
+            "place": ["P", "P", "P"],
+            "author_id": ["VIAF:1", None, None],
+            "author_name": ["Someone", None, None],
+        }))
+        self.assertEqual([type(o).__name__ for o in objects], ["Map", "Painting"])
+        self.assertEqual(objects[0].getId(), "1")
+        self.assertEqual([a.getName() for a in objects[0].getAuthors()], ["Someone"])
+        self.assertEqual(objects[1].getAuthors(), [])
+
+        self.load()
+        q = self.open()
+        m.addProcessHandler(q)
+
+        activities = m.getAllActivities()
+        self.assertEqual(len(activities), len(q.getAllActivities()))
+        for activity_type in ACTIVITY_TYPES:
+            self.assertEqual(
+                sum(type(a).__name__ == activity_type for a in activities), 35
+            )
+        for a in m.getAcquisitionsByTechnique("photo"):
+            self.assertIsInstance(a, Acquisition)
+            self.assertIn("photo", a.getTechnique().lower())
+
+    def test_11_entities(self):
+        author = Person("VIAF:1", "Someone")
+        obj = CulturalHeritageObject(1, "A", "1700", "O", "P", author)
+        self.assertEqual(obj.getId(), "1")
+        self.assertEqual(obj.getAuthors(), [author])
+        shorthand = CulturalHeritageObject(2, "B", None, "O", "P", author_id="VIAF:1",
+                                           author_name="Someone")
+        self.assertEqual([a.getId() for a in shorthand.getAuthors()], ["VIAF:1"])
+        self.assertIsNone(shorthand.getDate())
+
+        acquisition = Acquisition(obj, "I", "T", "Person", "2023", "2024", "Tool")
+        self.assertIs(acquisition.refersTo(), obj)
+        self.assertEqual(acquisition.getTools(), ["Tool"])
+        self.assertEqual(acquisition.getTechnique(), "T")
+
+        for entity in (author, obj, shorthand, acquisition):
+            self.assertFalse(hasattr(entity, "__dict__"))
+
+    def test_12_identity_map(self):
+        self.load()
+        q = self.open()
+        m = AdvancedMashup()
+        m.addProcessHandler(q)
+
+        activities = [a for a in m.getAllActivities() if a.refersTo().getId() == "1"]
+        self.assertEqual(len(activities), len(ACTIVITY_TYPES))
+        self.assertEqual(len({id(a.refersTo()) for a in activities}), 1)
+
+        objects = m._objectsFromDataFrame(DataFrame({
+            "type_name": ["Map", "Map", "Painting"],
+            "id": ["1", "1", "2"],
+            "title": ["A", "A", "B"],
+            "date": ["1700", "1700", "1800"],
+            "owner": ["O", "O", "O"],
+            "place": ["P", "P", "P"],
+            "author_id": ["VIAF:1", "VIAF:2", "VIAF:1"],
+            "author_name": ["Someone", "Someone else", "Someone"],
+        }))
+        self.assertEqual([o.getId() for o in objects], ["1", "2"])
+        self.assertEqual([a.getId() for a in objects[0].getAuthors()], ["VIAF:1", "VIAF:2"])
+        self.assertIs(objects[0].getAuthors()[0], objects[1].getAuthors()[0])
+
+        # every call has its own instances: earlier results are not changed
+        # and the authors are the ones of the current rows
+        again = m._objectsFromDataFrame(DataFrame({
+            "type_name": ["Painting"], "id": ["1"], "title": ["Z"], "date": ["1900"],
+            "owner": ["O"], "place": ["P"], "author_id": ["VIAF:2"],
+            "author_name": ["Someone else"],
+        }))
+        self.assertIsNot(again[0], objects[0])
+        self.assertEqual([a.getId() for a in again[0].getAuthors()], ["VIAF:2"])
+        self.assertEqual([a.getId() for a in objects[0].getAuthors()], ["VIAF:1", "VIAF:2"])
+        self.assertEqual((type(objects[0]).__name__, objects[0].getTitle()), ("Map", "A"))
+        self.assertIsNot(m.getAllActivities()[0].refersTo(), activities[0].refersTo())
+
+        # the activities refer to the objects whose metadata the call fetched
+        class AuthorHandler(MetadataQueryHandler):
+            def getCulturalHeritageObjectsAuthoredBy(self, input_id):
+                return DataFrame({
+                    "type_name": ["Map"], "id": ["1"], "title": ["A"], "date": ["1700"],
+                    "owner": ["O"], "place": ["P"], "name": ["Someone"],
+                    "author_id": ["VIAF:1"],
+                })
+
+            async def agetCulturalHeritageObjectsAuthoredBy(self, input_id):
+                return self.getCulturalHeritageObjectsAuthoredBy(input_id)
+
+        m = AdvancedMashup([AuthorHandler()], [q])
+        for on_object in (
+            m.getActivitiesOnObjectsAuthoredBy("VIAF:1"),
+            asyncio.run(
+                AsyncAdvancedMashup([AuthorHandler()], [q]).agetActivitiesOnObjectsAuthoredBy(
+                    "VIAF:1"
+                )
+            ),
+        ):
+            self.assertEqual(len(on_object), len(ACTIVITY_TYPES))
+            self.assertEqual(len({id(a.refersTo()) for a in on_object}), 1)
+            obj = on_object[0].refersTo()
+            self.assertEqual((type(obj).__name__, obj.getId(), obj.getTitle()), ("Map", "1", "A"))
+            self.assertEqual(obj.getOwner(), "O")
+
+    def test_13_lazy_results(self):
+        self.load()
+        q = self.open()
+
+        def key(a):
+            return (type(a).__name__, a.refersTo().getId(), a.getResponsiblePerson())
+
+        eager = [key(a) for a in BasicMashup([], [q]).getAllActivities()]
+        lazy = BasicMashup([], [q], lazy=True).getAllActivities()
+        self.assertIsInstance(lazy, LazyResult)
+        self.assertEqual(len(lazy), len(eager))
+        self.assertEqual([key(a) for a in lazy], eager)
+        self.assertEqual(key(lazy[-1]), eager[-1])
+        self.assertEqual([key(a) for a in lazy[10:20]], eager[10:20])
+        self.assertEqual([key(a) for a in lazy[::-7][2:5]], eager[::-7][2:5])
+        self.assertEqual(len(lazy[10:20].to_dataframe()), 10)
+        with self.assertRaises(IndexError):
+            lazy[len(eager)]
+
+        techniques = BasicMashup([], [q], lazy=True).getAcquisitionsByTechnique("photo")
+        self.assertTrue(all(isinstance(a, Acquisition) for a in techniques))
+
+        objects = AdvancedMashup(lazy=True)._objectsFromDataFrame(DataFrame({
+            "type_name": ["Map", "Painting", "Map", "Statue"],
+            "id": ["1", "2", "1", "3"],
+            "title": ["A", "B", "A", "C"],
+            "date": ["1700", "1800", "1700", "1900"],
+            "owner": ["O", "O", "O", "O"],
+            "place": ["P", "P", "P", "P"],
+            "author_id": ["VIAF:1", "VIAF:1", "VIAF:2", None],
+            "author_name": ["Someone", "Someone", "Someone else", None],
+        }))
+        self.assertEqual(len(objects), 2)
+        self.assertEqual(len(objects[:1].to_dataframe()), 2)
+        self.assertEqual([a.getId() for a in objects[0].getAuthors()], ["VIAF:1", "VIAF:2"])
+        self.assertEqual([o.getTitle() for o in objects], ["A", "B"])
+
+        # empty results are LazyResults too: no handler, or no rows to build
+        m = AdvancedMashup([], [], lazy=True)
+        for empty in (
+            m.getAllActivities(),
+            m.getAllCulturalHeritageObjects(),
+            m.getAcquisitionsByTechnique("photo"),
+            m.getActivitiesOnObjectsAuthoredBy("VIAF:1"),
+            m.getObjectsHandledByResponsiblePerson("Hopper"),
+            m._activitiesFromDataFrame(DataFrame()),
+            m._objectsHandledBy(DataFrame(), DataFrame()),
+            asyncio.run(AsyncAdvancedMashup([], [], lazy=True).agetAllActivities()),
+        ):
+            self.assertIsInstance(empty, LazyResult)
+            self.assertEqual(len(empty), 0)
+            self.assertEqual(list(empty), [])
+            self.assertTrue(empty.to_dataframe().empty)
+        self.assertEqual(AdvancedMashup([], []).getAllActivities(), [])
+
+    def test_14_objects_handled_by(self):
+        activities = DataFrame({"object_id": ["2", "1", "2", "9"]})
+        objects = DataFrame({
+            "type_name": ["Map", "Map", "Painting", "Map"],
+            "id": [1, 1, 2, 5],
+            "title": ["A", "A", "B", "E"],
+            "date": ["1700", "1700", "1800", "1900"],
+            "owner": ["O", "O", "O", "O"],
+            "place": ["P", "P", "P", "P"],
+            "author_id": ["VIAF:1", "VIAF:2", None, None],
+            "author_name": ["Someone", "Someone else", None, None],
+        })
+        for lazy in (False, True):
+            result = list(AdvancedMashup(lazy=lazy)._objectsHandledBy(activities, objects))
+            self.assertEqual([o.getId() for o in result], ["2", "1"])
+            self.assertEqual(
+                [a.getId() for a in result[1].getAuthors()], ["VIAF:1", "VIAF:2"]
+            )
+
+    def test_15_sparql_templates(self):
+        query = MetadataQueryHandler.authors_query.bind(input_id='x" } #\n')
+        self.assertTrue(query.startswith("PREFIX rdf:"))
+        self.assertIn('?entity schema:identifier "x\\" } #\\n" .', query)
+
+        query = MetadataQueryHandler.authors_by_ids_query.bind(input_ids=["1", 2])
+        self.assertIn('VALUES ?object_id { "1" "2" }', query)
+        with self.assertRaises(KeyError):
+            MetadataQueryHandler.authors_query.bind()
+
+    def test_16_sparql_transport(self):
+        answers = [(503, "text/plain", b"busy")]
+
+        def answer(headers, body):
+            if answers:
+                return answers.pop(0)
+            if "json" in headers["Accept"]:
+                return 200, "application/sparql-results+json", json.dumps({
+                    "head": {"vars": ["id", "name", "count"]},
+                    "results": {"bindings": [
+                        {"id": {"type": "literal", "value": "1"},
+                         "name": {"type": "literal", "value": "A"},
+                         "count": {"type": "literal", "value": "3", "datatype":
+                                   "http://www.w3.org/2001/XMLSchema#integer"}},
+                        {"id": {"type": "literal", "value": "2"}},
+                    ]},
+                }).encode()
+            if "csv" in headers["Accept"]:
+                return 200, "text/csv", b'id,name,count\r\n1,"A ""B""",3\r\n2,,\r\n'
+            return (200, "text/tab-separated-values",
+                    b'?id\t?name\t?count\n"1"\t"A \\"B\\""\t3\n"2"\t\t\n')
+
+        with StubEndpoint(answer) as endpoint:
+            # CSV results come with the types read_csv infers
+            q = MetadataQueryHandler(timeout=5, retries=1)
+            q.setDbPathOrUrl(endpoint.url)
+            df = q.getAllPeople()
+            self.assertEqual(df["id"].tolist(), [1, 2])
+            self.assertEqual(df["name"].iloc[0], 'A "B"')
+            self.assertTrue(df["name"].isna().iloc[1])
+
+            for result_format in ("json", "tsv"):
+                q = MetadataQueryHandler(timeout=5, retries=1, result_format=result_format)
+                q.setDbPathOrUrl(endpoint.url)
+                df = q.getAllPeople()
+                self.assertEqual(df["id"].tolist(), ["1", "2"])
+                self.assertEqual(str(df["count"].dtype), "Int64")
+                self.assertEqual(df["count"].iloc[0], 3)
+                self.assertTrue(df["name"].isna().iloc[1])
+            self.assertEqual(df["name"].iloc[0], 'A "B"')
+            # the first answer was a 503 that got retried
+            self.assertEqual(len(endpoint.requests), 4)
+            with self.assertRaises(ValueError):
+                MetadataQueryHandler(result_format="xml")
+
+        # an empty answer is an empty result
+        with StubEndpoint(lambda headers, body: (200, "text/plain", b"")) as endpoint:
+            for result_format in ("csv", "tsv"):
+                q = MetadataQueryHandler(timeout=5, result_format=result_format)
+                q.setDbPathOrUrl(endpoint.url)
+                self.assertTrue(q.getAllPeople().empty)
+
+        # large TSV results are decoded by read_csv when every cell is a plain
+        # literal, and one cell at a time otherwise
+        rows = b'"1"\t"A \\"B\\""\n' * 10000
+        for last, expected in (
+            (b'"2"\t\n', ["2", None]),
+            (b'"2"\t""\n', ["2", ""]),
+            (b'"2"\t"a\\tb"\n', ["2", "a\tb"]),
+            (b'<http://x/2>\t"b"@en\n', ["http://x/2", "b"]),
+        ):
+            df = _sparql_tsv_frame(b"?id\t?name\n" + rows + last)
+            self.assertEqual(len(df), 10001)
+            self.assertEqual(df.iloc[0].tolist(), ["1", 'A "B"'])
+            row = df.iloc[-1]
+            self.assertEqual([None if isna(x) else x for x in row], expected)
+
+    def test_17_object_type_triples(self):
+        chunk = DataFrame({
+            "Id": ["1", "2"], "Type": ["Nautical chart", "Spaceship"],
+            "Title": ["T", "U"], "Date": ["1700", ""], "Owner": ["O", "O"],
+            "Place": ["P", "P"], "Author": ["Doe, John (VIAF:1)", ""],
+        }, dtype=str)
+        triples = set(MetadataUploadHandler()._chunkToTriples(chunk))
+        uri = "<" + MetadataUploadHandler.base_url + "1>"
+        self.assertIn(uri + " <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> "
+                      "<https://schema.org/CulturalHeritageObject> .", triples)
+        self.assertIn(uri + ' <https://schema.org/additionalType> "NauticalChart" .',
+                      triples)
+        # objects of unknown type get neither class
+        self.assertFalse(any("additionalType" in t for t in triples if "/2>" in t))
+        for query in (MetadataQueryHandler.all_objects_query.bind(),
+                      MetadataQueryHandler.authored_by_query.bind(input_id="VIAF:1")):
+            self.assertIn("schema:additionalType ?type_name", query)
+            self.assertNotIn("FILTER", query)
+
+    def test_18_fan_out(self):
+        self.load()
+
+        class SlowHandler(ProcessDataQueryHandler):
+            def getAllActivities(self):
+                time.sleep(2)
+                return DataFrame({"type": ["Acquisition"], "object_id": ["late"]})
+
+        handlers = [
+            self.open(handler=cls)
+            for cls in (ProcessDataQueryHandler, ProcessDataQueryHandler, SlowHandler)
+        ]
+
+        expected = len(BasicMashup([], handlers[:1]).getAllActivities())
+        # two shards holding the same activities give each of them once
+        self.assertEqual(len(BasicMashup([], handlers[:2]).getAllActivities()), expected)
+
+        m = BasicMashup([], handlers, timeout=0.5)
+        started = time.monotonic()
+        self.assertEqual(len(m.getAllActivities()), expected)
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(BasicMashup([], []).getAllActivities(), [])
+        # a single handler is not waited for longer than the timeout either
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            BasicMashup([], handlers[2:], timeout=0.3).getAllActivities()
+        self.assertLess(time.monotonic() - started, 1.5)
+
+        # the pool of the mashup is reused, and so are the connections
+        m = BasicMashup([], handlers[:2])
+        for _ in range(50):
+            m.getActivitiesStartedAfter("2023")
+        self.assertLessEqual(len(handlers[0]._connections), 2 + MASHUP_WORKERS)
+        m.close()
+
+        # a shard whose file is missing and one without the activity tables
+        missing = self.open(self.tmp.name + sep + "missing.db")
+        empty = self.tmp.name + sep + "empty.db"
+        sqlite3.connect(empty).close()
+        empty = self.open(empty)
+        self.assertEqual(
+            len(BasicMashup([], [missing, empty, handlers[0]]).getAllActivities()), expected
+        )
+        # with no shard answering the error is not taken for an empty result
+        for shards in ([missing], [empty], [missing, empty]):
+            for timeout in (None, 5):
+                with self.assertRaises((sqlite3.Error, DatabaseError)):
+                    BasicMashup([], shards, timeout=timeout).getAllActivities()
+            with self.assertRaises((sqlite3.Error, DatabaseError)):
+                asyncio.run(AsyncAdvancedMashup([], shards).agetAllActivities())
+        # called on their own, the handlers still print the error instead
+        self.assertTrue(missing.getAllActivities().empty)
+
+    def test_19_ids_pushed_down(self):
+        self.load()
+        q = self.open()
+
+        all_activities = q.getAllActivities()
+        ids = sorted(set(all_activities["object_id"].astype(str)))[:3]
+        result = q.getActivitiesOnObjects(ids, batch_size=2)
+        self.assertEqual(len(result), all_activities["object_id"].isin(ids).sum())
+        self.assertEqual(len(q.getActivitiesOnObjects([])), 0)
+        # a whole batch fits in the 999 variables of SQLite before 3.32,
+        # the ids are bound once for all the activity tables
+        q._connection().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        many = ids + [f"missing {i}" for i in range(400)]
+        self.assertEqual(len(q.getActivitiesOnObjects(many)), len(result))
+        plan = q.getQueryPlan("getActivitiesOnObjects", ids)
+        for detail in plan["detail"]:
+            if detail.startswith(("SCAN", "SEARCH")):
+                self.assertIn("USING INDEX", detail)
+
+        class AuthorHandler(MetadataQueryHandler):
+            def getCulturalHeritageObjectsAuthoredBy(self, input_id):
+                return DataFrame({"id": ids})
+
+        m = AdvancedMashup([AuthorHandler()], [q])
+        activities = m.getActivitiesOnObjectsAuthoredBy("VIAF:1")
+        self.assertEqual(len(activities), len(result))
+        self.assertEqual({a.refersTo().getId() for a in activities}, set(ids))
+
+    def test_20_async_api(self):
+        self.load()
+        q = self.open()
+        ids = sorted(set(q.getAllActivities()["object_id"].astype(str)))[:3]
+
+        class AuthorHandler(MetadataQueryHandler):
+            async def agetCulturalHeritageObjectsAuthoredBy(self, input_id):
+                return DataFrame({"id": ids})
+
+        endpoint = StubEndpoint(csv_answer(b"id,name\nVIAF:1,Someone\n"))
+        qm = MetadataQueryHandler(timeout=5)
+        qm.setDbPathOrUrl(endpoint.url)
+
+        async def run():
+            m = AsyncAdvancedMashup([qm], [q])
+            people, activities, tools, techniques, on_objects = await asyncio.gather(
+                m.agetAllPeople(),
+                m.agetAllActivities(),
+                m.agetActivitiesUsingTool("blender"),
+                m.agetAcquisitionsByTechnique("photo", "prefix"),
+                AsyncAdvancedMashup([AuthorHandler()], [q]).agetActivitiesOnObjectsAuthoredBy(
+                    "VIAF:1"
+                ),
+            )
+            await qm.aclose()
+            return people, activities, tools, techniques, on_objects
+
+        with endpoint:
+            people, activities, tools, techniques, on_objects = asyncio.run(run())
+        self.assertEqual([p.getId() for p in people], ["VIAF:1"])
+        self.assertEqual(len(activities), len(BasicMashup([], [q]).getAllActivities()))
+        self.assertEqual(len(tools), len(q.getActivitiesUsingTool("blender")))
+        self.assertEqual(len(techniques), len(q.getAcquisitionsByTechnique("photo", "prefix")))
+        self.assertEqual(len(on_objects), len(q.getActivitiesOnObjects(ids)))
+
+    def test_21_result_cache(self):
+        cache = ResultCache(max_entries=2, ttl=None)
+        for key in ("a", "b", "c"):
+            cache.put(("db", key), DataFrame({"x": [key]}))
+        self.assertIsNone(cache.get(("db", "a")))
+        # a copy is returned, changing it leaves the cached one alone
+        df = cache.get(("db", "b"))
+        df["x"] = "changed"
+        self.assertEqual(cache.get(("db", "b"))["x"].tolist(), ["b"])
+
+        cache = ResultCache(ttl=0.05, max_bytes=10 ** 6)
+        cache.put(("db", "big"), DataFrame({"x": range(10 ** 6)}))
+        cache.put(("db", "small"), DataFrame({"x": [1]}))
+        self.assertEqual(len(cache), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(("db", "small")))
+
+        u = self.load()
+        cache = ResultCache()
+        q = self.open(cache=cache)
+        first = q.getAllActivities()
+        self.assertEqual(len(q.getAllActivities()), len(first))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # uploading to the same database drops its results
+        self.assertTrue(u.pushDataToDb(self.process))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(q.getAllActivities()), 2 * len(first))
+
+    def test_22_data_version(self):
+        q = self.open(cache=ResultCache(versioned=True))
+        stale = self.open(cache=ResultCache())
+        for version in (1, 2):
+            self.load()
+            self.assertEqual(q.getDataVersion(), version)
+        self.assertGreater(len(q.getAllActivities()), 0)
+        self.assertGreater(len(stale.getAllActivities()), 0)
+
+        # a load done by another process, which cannot reach these caches
+        with sqlite3.connect(self.relational) as conn:
+            for activity_type in ACTIVITY_TYPES:
+                conn.execute(f"DELETE FROM {activity_type}")
+            conn.execute("PRAGMA user_version=3")
+        self.assertEqual(q.getDataVersion(), 3)
+        self.assertEqual(len(q.getAllActivities()), 0)
+        self.assertGreater(len(stale.getAllActivities()), 0)
+
+        answers = [b"version\n3\n", b"version\n"]
+
+        def answer(headers, body):
+            return 200, "text/csv", answers.pop(0)
+
+        with StubEndpoint(answer) as endpoint:
+            qm = MetadataQueryHandler(timeout=5)
+            qm.setDbPathOrUrl(endpoint.url)
+            self.assertEqual(qm.getDataVersion(), 3)
+            self.assertEqual(qm.getDataVersion(), 0)
+
+    def test_23_id_batching(self):
+        def values(body):
+            query = parse_qs(body.decode())["query"][0]
+            block = re.search(r"VALUES \?\w+ \{([^}]*)\}", query)
+            return re.findall(r'"([^"]*)"', block.group(1)) if block else []
+
+        def answer(headers, body):
+            # one author for every object, with the id of the object
+            rows = b"".join(
+                b'"%s"\t"VIAF:%s"\t"Author %s"\n' % ((i.encode(),) * 3)
+                for i in values(body)
+            )
+            return 200, "text/tab-separated-values", b"?object_id\t?id\t?name\n" + rows
+
+        with StubEndpoint(answer) as endpoint:
+            qm = MetadataQueryHandler(timeout=5, result_format="tsv")
+            qm.setDbPathOrUrl(endpoint.url)
+
+            ids = ["1", "2", 2, "3", "1", "4", "5"]
+            authors = qm.getAuthorsOfCulturalHeritageObjects(ids, batch_size=3)
+            self.assertEqual(
+                [values(body) for _, body in endpoint.requests],
+                [["1", "2", "3"], ["4", "5"]],
+            )
+            self.assertEqual(authors["object_id"].tolist(), ["1", "2", "3", "4", "5"])
+            self.assertEqual(authors["id"].tolist(), ["VIAF:1", "VIAF:2", "VIAF:3", "VIAF:4", "VIAF:5"])
+
+            del endpoint.requests[:]
+            qm.getCulturalHeritageObjectsByIds(ids, batch_size=2)
+            self.assertEqual(
+                [values(body) for _, body in endpoint.requests],
+                [["1", "2"], ["3", "4"], ["5"]],
+            )
+            self.assertEqual(len(qm.getAuthorsOfCulturalHeritageObjects([])), 0)
+
+            # the authors of all the objects in the time frame are looked up
+            # with a single query
+            self.load()
+            q = self.open()
+            del endpoint.requests[:]
+            people = AdvancedMashup([qm], [q]).getAuthorsOfObjectsAcquiredInTimeFrame(
+                "1088-01-01", "2029-01-01"
+            )
+            self.assertEqual(len(endpoint.requests), 1)
+            object_ids = set(q.getAllActivities()["object_id"].astype(str))
+            self.assertEqual(set(values(endpoint.requests[0][1])), object_ids)
+            self.assertEqual({p.getId() for p in people}, {"VIAF:" + i for i in object_ids})
+
+    def test_24_triple_upload(self):
+        failing = []
+
+        def answer(headers, body):
+            if failing and failing.pop(0):
+                return 500, "text/plain", b"error"
+            return 200, "text/plain", b"ok"
+
+        lines = ["<s%d> <p> <o> ." % i for i in range(10)]
+        with StubEndpoint(answer) as endpoint:
+            for bulk_load in (False, True):
+                del endpoint.requests[:]
+                u = MetadataUploadHandler(batch_size=4, bulk_load=bulk_load)
+                u.setDbPathOrUrl(endpoint.url)
+                self.assertEqual(u.uploadTriples(iter(lines)), 10)
+                self.assertGreater(u.throughput, 0)
+
+                # three batches of at most batch_size triples, then the
+                # update of the data version
+                *batches, version = endpoint.requests
+                bodies = []
+                for headers, body in batches:
+                    if bulk_load:
+                        self.assertTrue(headers["Content-Type"].startswith("text/plain"))
+                        bodies.append(body.decode())
+                    else:
+                        update = parse_qs(body.decode())["update"][0]
+                        self.assertTrue(update.startswith("INSERT DATA {"))
+                        bodies.append(update[len("INSERT DATA {"):-1].strip())
+                self.assertEqual(
+                    [b.splitlines() for b in bodies], [lines[:4], lines[4:8], lines[8:]]
+                )
+                self.assertIn("schema:version", parse_qs(version[1].decode())["update"][0])
+
+            # the version is still updated for the batches sent before a failed one
+            del endpoint.requests[:]
+            failing.extend([False, True])
+            u = MetadataUploadHandler(batch_size=4)
+            u.setDbPathOrUrl(endpoint.url)
+            with self.assertRaises(requests.HTTPError):
+                u.uploadTriples(iter(lines))
+            self.assertEqual(len(endpoint.requests), 3)
+            self.assertIn("update", parse_qs(endpoint.requests[-1][1].decode()))
+
+            # a failed update of the version is retried, and fails the load
+            # when no attempt succeeds
+            del endpoint.requests[:]
+            failing.extend([False, False, False, True])
+            self.assertEqual(u.uploadTriples(iter(lines)), 10)
+            self.assertEqual(len(endpoint.requests), 5)
+
+            metadata = self.tmp.name + sep + "meta.csv"
+            with open(metadata, "w") as f:
+                f.write("Id,Type,Title,Date,Author,Owner,Place\n")
+                f.write("1,Map,A,1700,\"Doe, John (VIAF:1)\",O,P\n")
+            failing.extend([False, True, True, True])
+            self.assertFalse(u.pushDataToDb(metadata))
+            self.assertEqual(failing, [])
+
+    def test_25_failed_load_rolls_back(self):
+        with open(self.process) as f:
+            items = json.load(f)
+        # valid items, inserted in several chunks, then a broken one
+        broken = self.tmp.name + sep + "broken.json"
+        with open(broken, "w") as f:
+            json.dump(items + [{"object id": "x"}], f)
+        truncated = self.tmp.name + sep + "truncated.json"
+        with open(truncated, "w") as f:
+            f.write(json.dumps(items)[:-100])
+
+        for path in (broken, truncated):
+            for stream in (True, False):
+                database = self.relational + str(stream) + path[-9:]
+                u = ProcessDataUploadHandler(stream=stream, chunk_size=7)
+                u.setDbPathOrUrl(database)
+                self.assertFalse(u.pushDataToDb(path))
+                with sqlite3.connect(database) as conn:
+                    tables = conn.execute("SELECT name FROM sqlite_master").fetchall()
+                self.assertEqual(tables, [])
+
+                # a database loaded before keeps its rows and version
+                self.load(database)
+                self.assertFalse(u.pushDataToDb(path))
+                q = self.open(database)
+                self.assertEqual(len(q.getAllActivities()), 175)
+                self.assertEqual(q.getDataVersion(), 1)
+
 # Running tests:
 if __name__ == '__main__':
     testProject = TestProjectBasic()